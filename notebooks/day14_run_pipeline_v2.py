@@ -1,8 +1,9 @@
 import mlflow
 from src.pipeline.pipeline_v2 import AnimePipeline
+from src.pipeline.tracking import tracking_uri
 
 # 👉 mlflow.set_tracking_uri(): 指定要連線的 MLflow Tracking Server
-mlflow.set_tracking_uri("http://mlflow:5000")
+mlflow.set_tracking_uri(tracking_uri())  # 可用 MLFLOW_TRACKING_URI=file:///... 改成本機 file store
 
 # 👉 mlflow.set_experiment(): 指定實驗名稱，若不存在會自動建立
 mlflow.set_experiment("anime-recsys-pipeline_v2")
@@ -1,7 +1,8 @@
 import mlflow
 from src.pipeline.pipeline_v4 import AnimePipelineV4
+from src.pipeline.tracking import tracking_uri
 
-mlflow.set_tracking_uri("http://mlflow:5000")
+mlflow.set_tracking_uri(tracking_uri())  # 可用 MLFLOW_TRACKING_URI=file:///... 改成本機 file store
 mlflow.set_experiment("anime-recsys-pipeline-v4")
 
 def main():
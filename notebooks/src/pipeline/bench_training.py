@@ -0,0 +1,116 @@
+"""訓練流程的規模 benchmark：在不同資料量下量測各訓練入口的時間與記憶體高峰
+
+每個 scale 先以 synthetic_data 產生資料（已存在則沿用），再以獨立子行程執行每個入口，
+透過 ANIME_DATA_DIR 指向合成資料、MLflow 寫到本機 file store，因此不需要 Kaggle 資料與 MLflow server。
+子行程以 os.wait4 取得各自的 CPU 時間與 peak RSS；失敗（OOM、timeout）也會記錄下來，方便找出極限。
+
+結果附加到 <root>/results.csv，可跨版本比較。
+
+用法：python -m src.pipeline.bench_training --scales 1 5 20 --root /tmp/anime-bench
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from src.pipeline.synthetic_data import generate, read_summary
+
+NOTEBOOKS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+_PIPELINE_V3 = (
+    "from src.pipeline.pipeline_v3 import AnimePipelineV3\n"
+    "pipeline = AnimePipelineV3(sample_size=None)\n"
+    "anime, _ = pipeline.load_data()\n"
+    "pipeline.train_model(anime, max_features=1000, ngram_range=(1, 1), min_df=2, use_type=True)\n"
+)
+
+# 入口名稱 → 指令（cwd 為 notebooks/）
+ENTRIES = {
+    "data_store_convert": [sys.executable, "-m", "src.pipeline.data_store"],
+    "train_user_based": [sys.executable, "src/train_user_based.py", "--top_k", "10"],
+    "train_item_based": [sys.executable, "src/train_item_based.py", "--top_k", "10"],
+    "pipeline_v3_train": [sys.executable, "-c", _PIPELINE_V3],
+    "user_topk": [sys.executable, "-m", "src.pipeline.user_topk", "--top_k", "10"],
+}
+
+
+def run_entry(cmd, env, timeout):
+    """執行子行程，回傳 (returncode, wall 秒數, user/sys CPU 秒數, peak RSS MB, stderr 結尾)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=NOTEBOOKS_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    timer = threading.Timer(timeout, proc.send_signal, args=(signal.SIGKILL,)) if timeout else None
+    if timer:
+        timer.start()
+    stderr = proc.stderr.read().decode(errors="replace")
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    if timer:
+        timer.cancel()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # Linux 的 ru_maxrss 單位是 KB，macOS 是 bytes
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+    return proc.returncode, wall, usage.ru_utime, usage.ru_stime, rss_mb, stderr.strip()[-300:]
+
+
+def run_benchmark(scales, root, entries=None, timeout=3600, seed=42):
+    root = os.path.abspath(root)
+    entries = entries or list(ENTRIES)
+    rows = []
+    for scale in scales:
+        data_dir = os.path.join(root, f"scale_{scale:g}")
+        summary = read_summary(data_dir)
+        if summary is None or summary["scale"] != scale or summary["seed"] != seed:
+            print(f"🧪 產生 {scale:g}× 合成資料 → {data_dir}")
+            summary = generate(data_dir, scale, seed)
+
+        env = {
+            **os.environ,
+            "ANIME_DATA_DIR": data_dir,
+            "MLFLOW_TRACKING_URI": Path(root, "mlruns").as_uri(),
+            "ANIME_FEATURE_STORE": "off",  # 量測真正的 fit 成本，不使用特徵快取
+            "PYTHONPATH": NOTEBOOKS_DIR,
+        }
+        for name in entries:
+            code, wall, utime, stime, rss_mb, err = run_entry(ENTRIES[name], env, timeout)
+            status = "ok" if code == 0 else ("killed" if code < 0 else "failed")
+            print(f"  ⏱️ {scale:g}× {name:<20} {status:<6} {wall:8.1f}s  peak {rss_mb:8.0f} MB")
+            rows.append({
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+                "scale": scale,
+                "entry": name,
+                "n_anime": summary["anime"],
+                "n_ratings_train": summary["ratings_train"],
+                "status": status,
+                "returncode": code,
+                "wall_s": round(wall, 2),
+                "user_cpu_s": round(utime, 2),
+                "sys_cpu_s": round(stime, 2),
+                "peak_rss_mb": round(rss_mb, 1),
+                "error": "" if code == 0 else err,
+            })
+
+    results = pd.DataFrame(rows)
+    out_path = os.path.join(root, "results.csv")
+    results.to_csv(out_path, mode="a", header=not os.path.exists(out_path), index=False)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="訓練入口的規模 benchmark")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--root", default="/tmp/anime-bench", help="合成資料、MLflow store 與結果的存放位置")
+    parser.add_argument("--entries", nargs="+", choices=list(ENTRIES), default=None)
+    parser.add_argument("--timeout", type=int, default=3600, help="單一入口的時間上限（秒）")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.scales, args.root, args.entries, args.timeout)
+    print(results.pivot_table(index="entry", columns="scale", values=["wall_s", "peak_rss_mb"]).round(1).to_string())
+    print(f"📄 結果已附加到 {os.path.join(os.path.abspath(args.root), 'results.csv')}")
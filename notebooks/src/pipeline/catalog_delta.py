@@ -0,0 +1,164 @@
+"""目錄增量更新：新增 / 修改 / 下架作品時不必重跑 day25、重新 fit、重新部署
+
+- 新作品以「目前上線版本」已 fit 好的 vectorizer 轉成 TF-IDF 列（詞彙不變），存成小型 delta .npz
+- delta 以 artifact 形式掛在該模型版本的 run 底下（catalog_deltas/delta-000001.npz ...），
+  因此永遠對應正確的詞彙；serving 端（FastAPI）定期列出並下載新的 delta，
+  呼叫 TFIDFRecommender.apply_delta() 原地套用，不用重新載入整個模型
+- delta 累積多了以後執行 compact：合併目錄、以相同參數重新 fit，註冊成新版本並切到同一個 stage
+
+用法：
+    python -m src.pipeline.catalog_delta add --csv new_anime.csv          # 新增或更新（依 anime_id）
+    python -m src.pipeline.catalog_delta add --remove 32281 5114          # 下架
+    python -m src.pipeline.catalog_delta list
+    python -m src.pipeline.catalog_delta compact
+"""
+import os
+import json
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+DELTA_ARTIFACT_DIR = "catalog_deltas"
+MODEL_NAME = "AnimeRecsysTFIDF"
+TEXT_COLUMN = "genre"  # day25 以 genre 欄 fit vectorizer
+
+
+def build_delta(vectorizer, items=None, removed=(), text_column=TEXT_COLUMN):
+    """以既有 vectorizer 把 items 轉成 TF-IDF 列；回傳 {"anime", "matrix", "removed"}"""
+    if items is None:
+        items = pd.DataFrame(columns=["anime_id", "name", text_column])
+    items = items.reset_index(drop=True)
+    text = items[text_column].astype("object").fillna("").astype(str) if len(items) else []
+    matrix = vectorizer.transform(text).astype(np.float32) if len(items) else sp.csr_matrix(
+        (0, len(vectorizer.vocabulary_)), dtype=np.float32
+    )
+    return {"anime": items, "matrix": sp.csr_matrix(matrix), "removed": np.asarray(removed, dtype=np.int64)}
+
+
+def save_delta(path, delta):
+    matrix = delta["matrix"]
+    np.savez_compressed(
+        path,
+        anime=np.array(delta["anime"].to_json(orient="records", force_ascii=False)),
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        removed=delta["removed"],
+    )
+
+
+def load_delta(path):
+    with np.load(path) as data:
+        anime = pd.DataFrame(json.loads(str(data["anime"])))
+        if "anime_id" not in anime.columns:
+            anime = pd.DataFrame({"anime_id": pd.Series(dtype="int64"), "name": pd.Series(dtype="object")})
+        anime["anime_id"] = anime["anime_id"].astype("int64")
+        matrix = sp.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+        return {"anime": anime, "matrix": matrix, "removed": data["removed"]}
+
+
+# === 與 Model Registry 的對應 ===
+def _model_version(client, model_name, stage):
+    versions = client.get_latest_versions(model_name, stages=[stage])
+    if not versions:
+        raise ValueError(f"{model_name} 沒有 {stage} 版本")
+    return versions[0]
+
+
+def list_deltas(client, run_id):
+    """該 run 底下已發佈的 delta artifact 路徑（依序號排序）"""
+    return sorted(
+        f.path for f in client.list_artifacts(run_id, DELTA_ARTIFACT_DIR)
+        if not f.is_dir and f.path.endswith(".npz")
+    )
+
+
+def publish_delta(model_name=MODEL_NAME, stage="Staging", items=None, removed=()):
+    """以上線版本的 vectorizer 建立 delta 並上傳到該版本的 run，回傳 artifact 路徑"""
+    import mlflow.pyfunc
+    from mlflow.tracking import MlflowClient
+
+    client = MlflowClient()
+    version = _model_version(client, model_name, stage)
+    recommender = mlflow.pyfunc.load_model(f"models:/{model_name}/{stage}").unwrap_python_model()
+    delta = build_delta(recommender.vectorizer, items, removed)
+
+    seq = len(list_deltas(client, version.run_id)) + 1
+    path = os.path.join(tempfile.mkdtemp(prefix="catalog-delta-"), f"delta-{seq:06d}.npz")
+    save_delta(path, delta)
+    client.log_artifact(version.run_id, path, DELTA_ARTIFACT_DIR)
+    print(f"📦 {model_name} v{version.version}：delta #{seq}（{len(delta['anime'])} 筆新增/更新、"
+          f"{len(delta['removed'])} 筆下架）")
+    return f"{DELTA_ARTIFACT_DIR}/{os.path.basename(path)}"
+
+
+def compact(model_name=MODEL_NAME, stage="Staging"):
+    """套用全部 delta 後以相同 vectorizer 參數重新 fit，註冊新版本並切到同一個 stage"""
+    import mlflow
+    import mlflow.pyfunc
+    from mlflow.tracking import MlflowClient
+    from sklearn.base import clone
+
+    from src.pipeline.tfidf_model import TFIDFRecommender, build_artifacts, DEFAULT_ANN_PARAMS, DEFAULT_MODEL_CONFIG
+    from src.pipeline.precision import precision_of
+
+    client = MlflowClient()
+    version = _model_version(client, model_name, stage)
+    recommender = mlflow.pyfunc.load_model(f"models:/{model_name}/{stage}").unwrap_python_model()
+    deltas = list_deltas(client, version.run_id)
+    for path in deltas:
+        recommender.apply_delta(client.download_artifacts(version.run_id, path), name=path)
+
+    anime = recommender.catalog()
+    precision = precision_of(recommender.tfidf_matrix)  # 沿用來源版本的儲存精度，不套用環境變數預設值
+    vectorizer = clone(recommender.vectorizer)
+    tfidf_matrix = vectorizer.fit_transform(anime[TEXT_COLUMN].astype("object").fillna("").astype(str))
+
+    artifact_dir = tempfile.mkdtemp(prefix="catalog-compact-")
+    artifacts = build_artifacts(anime, vectorizer, tfidf_matrix, artifact_dir, ann_params=DEFAULT_ANN_PARAMS,
+                                precision=precision)
+    with mlflow.start_run(run_name="tfidf-catalog-compact"):
+        mlflow.log_params({
+            "base_version": version.version, "deltas": len(deltas), "catalog_size": len(anime), "precision": precision,
+        })
+        mlflow.pyfunc.log_model(
+            artifact_path="model",
+            python_model=TFIDFRecommender(),
+            artifacts=artifacts,
+            code_paths=[os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))],
+            model_config=DEFAULT_MODEL_CONFIG,
+            registered_model_name=model_name,
+        )
+    latest = max(client.search_model_versions(f"name='{model_name}'"), key=lambda v: int(v.version))
+    client.transition_model_version_stage(model_name, latest.version, stage=stage)
+    print(f"✅ 已合併 {len(deltas)} 個 delta → {model_name} v{latest.version}（{len(anime)} 部作品，{stage}）")
+    return latest.version
+
+
+if __name__ == "__main__":
+    import mlflow
+    from mlflow.tracking import MlflowClient
+    from src.pipeline.tracking import tracking_uri
+
+    parser = argparse.ArgumentParser(description="AnimeRecsysTFIDF 目錄增量更新")
+    parser.add_argument("command", choices=["add", "list", "compact"])
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--stage", default="Staging")
+    parser.add_argument("--csv", help="新增或更新的作品（欄位同 anime_clean.csv）")
+    parser.add_argument("--remove", type=int, nargs="*", default=[], help="要下架的 anime_id")
+    args = parser.parse_args()
+
+    mlflow.set_tracking_uri(tracking_uri())
+    if args.command == "add":
+        publish_delta(args.model, args.stage, pd.read_csv(args.csv) if args.csv else None, args.remove)
+    elif args.command == "list":
+        client = MlflowClient()
+        version = _model_version(client, args.model, args.stage)
+        for path in list_deltas(client, version.run_id):
+            print(path)
+    else:
+        compact(args.model, args.stage)
@@ -0,0 +1,184 @@
+"""串流清理 + train/test 切分：取代 Day 4 / Day 5 notebook 中一次讀進整份 rating.csv 的做法
+
+- 原始 rating.csv 依 byte 範圍切成多個 part，各 part 由獨立行程讀取、過濾 rating == -1、切分後寫出
+  （每個行程同時只持有一個 part，記憶體上限約為 part_mb × 行程數）
+- 切分以 (user_id, anime_id) 的雜湊值決定，不需要亂數狀態也不需要看過全部資料：
+  同一筆評分永遠落在同一個集合，每位使用者的評分依比例分到 train / test / back_up
+- 每個 part 完成後寫入 .done 標記，中斷後重跑只處理未完成的 part；來源檔或參數改變時全部重做
+- 最後依 part 順序串接成 ratings_clean / ratings_train / ratings_test / ratings_back_up.csv
+
+預設比例沿用 Day 5：train 10%、test 5%、其餘 85% 為 back_up。
+
+用法：python -m src.pipeline.clean_split --train 0.1 --test 0.05 --workers 4
+"""
+import io
+import os
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.pipeline.data_store import DATA_DIR, RATINGS_DTYPES, ANIME_CSV, RATINGS_CSV
+
+RAW_ANIME = "anime.csv"
+RAW_RATINGS = "rating.csv"
+SPLITS = ("clean", "train", "test", "back_up")
+OUTPUT_CSV = {**RATINGS_CSV, "back_up": "ratings_back_up.csv"}
+PART_MB = 64
+FORMAT_VERSION = 1
+
+
+# === 雜湊切分 ===
+def split_hash(user_id, anime_id, seed=42):
+    """(user_id, anime_id) → [0, 1) 的均勻值（splitmix64，向量化、跨行程與平台結果一致）"""
+    with np.errstate(over="ignore"):
+        x = (np.asarray(user_id, dtype=np.uint64) << np.uint64(32)) | np.asarray(anime_id, dtype=np.uint64)
+        x = x + np.uint64(0x9E3779B97F4A7C15) * np.uint64(seed + 1)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def assign_split(ratings, train=0.10, test=0.05, seed=42):
+    """回傳每筆評分所屬集合：0 = train、1 = test、2 = back_up"""
+    u = split_hash(ratings["user_id"].to_numpy(), ratings["anime_id"].to_numpy(), seed)
+    return np.where(u < train, 0, np.where(u < train + test, 1, 2)).astype(np.int8)
+
+
+# === 切成 part ===
+def part_ranges(path, part_mb=PART_MB):
+    """依 byte 大小切成多段，每段都從完整的一行開始（跳過 header）"""
+    size = os.path.getsize(path)
+    step = part_mb * 1024 * 1024
+    with open(path, "rb") as f:
+        f.readline()
+        offsets = [f.tell()]
+        while offsets[-1] + step < size:
+            f.seek(offsets[-1] + step)
+            f.readline()  # 對齊到下一行開頭
+            if f.tell() >= size:
+                break
+            offsets.append(f.tell())
+    return list(zip(offsets, offsets[1:] + [size]))
+
+
+def process_part(src, start, end, work_dir, index, params):
+    """讀取 [start, end) 範圍、清理並切分，寫出此 part 的各集合 CSV（不含 header）"""
+    with open(src, "rb") as f:
+        f.seek(start)
+        block = f.read(end - start)
+    if block.strip():
+        ratings = pd.read_csv(io.BytesIO(block), header=None, names=list(RATINGS_DTYPES), dtype=RATINGS_DTYPES)
+    else:
+        ratings = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in RATINGS_DTYPES.items()})
+    del block
+    clean = ratings[ratings["rating"] != -1]
+    split = assign_split(clean, params["train"], params["test"], params["seed"])
+
+    counts = {"raw": len(ratings), "clean": len(clean)}
+    parts = {"clean": clean, "train": clean[split == 0], "test": clean[split == 1], "back_up": clean[split == 2]}
+    for name, frame in parts.items():
+        frame.to_csv(os.path.join(work_dir, f"{index:05d}.{name}.csv"), header=False, index=False)
+        counts[name] = len(frame)
+    with open(os.path.join(work_dir, f"{index:05d}.done"), "w", encoding="utf-8") as f:
+        json.dump(counts, f)
+    return index, counts
+
+
+def _read_done(work_dir, index):
+    path = os.path.join(work_dir, f"{index:05d}.done")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _prepare_work_dir(work_dir, manifest):
+    """manifest（來源檔大小 / mtime、參數）不同時清空重來，相同時保留已完成的 part"""
+    path = os.path.join(work_dir, "manifest.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if json.load(f) == manifest:
+                return
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def concat_parts(work_dir, n_parts, out_dir, splits=SPLITS):
+    """依 part 順序串接成最終 CSV（先寫 .tmp 再 rename，中途失敗不會留下半份檔案）"""
+    header = (",".join(RATINGS_DTYPES) + "\n").encode()
+    for name in splits:
+        target = os.path.join(out_dir, OUTPUT_CSV[name])
+        with open(target + ".tmp", "wb") as out:
+            out.write(header)
+            for i in range(n_parts):
+                with open(os.path.join(work_dir, f"{i:05d}.{name}.csv"), "rb") as part:
+                    shutil.copyfileobj(part, out, 16 * 1024 * 1024)
+        os.replace(target + ".tmp", target)
+
+
+# === 主流程 ===
+def clean_anime(data_dir=DATA_DIR):
+    """anime.csv 很小，直接整份處理：genre / type 缺值補 Unknown"""
+    anime = pd.read_csv(os.path.join(data_dir, RAW_ANIME))
+    anime = anime.fillna({"genre": "Unknown", "type": "Unknown"})
+    anime.to_csv(os.path.join(data_dir, ANIME_CSV), index=False)
+    return len(anime)
+
+
+def clean_and_split(data_dir=DATA_DIR, train=0.10, test=0.05, seed=42, workers=None, part_mb=PART_MB,
+                    keep_parts=False):
+    src = os.path.join(data_dir, RAW_RATINGS)
+    work_dir = os.path.join(data_dir, "clean_split_parts")
+    stat = os.stat(src)
+    params = {"train": train, "test": test, "seed": seed}
+    _prepare_work_dir(work_dir, {
+        "version": FORMAT_VERSION, "source": RAW_RATINGS, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "part_mb": part_mb, **params,
+    })
+
+    ranges = part_ranges(src, part_mb)
+    counts = {i: _read_done(work_dir, i) for i in range(len(ranges))}
+    todo = [i for i, c in counts.items() if c is None]
+    print(f"🧹 {RAW_RATINGS}：{len(ranges)} parts（{len(ranges) - len(todo)} 已完成，{len(todo)} 待處理）")
+
+    workers = workers or min(len(todo), os.cpu_count() or 1) or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_part, src, *ranges[i], work_dir, i, params) for i in todo]
+        for future in futures:
+            i, counts[i] = future.result()
+            print(f"  ✅ part {i + 1}/{len(ranges)}：{counts[i]['clean']:,}/{counts[i]['raw']:,} 筆有效評分")
+
+    concat_parts(work_dir, len(ranges), data_dir)
+    summary = {key: sum(c[key] for c in counts.values()) for key in ("raw", *SPLITS)}
+    summary.update({"train_frac": train, "test_frac": test, "seed": seed})
+    with open(os.path.join(data_dir, "clean_split.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    if not keep_parts:
+        shutil.rmtree(work_dir)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="串流清理 rating.csv 並以雜湊切分 train / test / back_up")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--train", type=float, default=0.10, help="train 比例")
+    parser.add_argument("--test", type=float, default=0.05, help="test 比例（其餘為 back_up）")
+    parser.add_argument("--seed", type=int, default=42, help="雜湊 seed；改變後切分結果不同")
+    parser.add_argument("--workers", type=int, default=None, help="平行行程數，預設為 CPU 數")
+    parser.add_argument("--part-mb", type=int, default=PART_MB, help="每個 part 的大小（MB）")
+    parser.add_argument("--keep-parts", action="store_true", help="保留中間 part 檔（預設完成後刪除）")
+    parser.add_argument("--skip-anime", action="store_true", help="不重新產生 anime_clean.csv")
+    args = parser.parse_args()
+
+    if not args.skip_anime:
+        print(f"🧹 anime_clean.csv：{clean_anime(args.data_dir)} 部作品")
+    summary = clean_and_split(args.data_dir, args.train, args.test, args.seed, args.workers, args.part_mb,
+                              args.keep_parts)
+    print(f"✅ 清理與切分完成：{summary}")
@@ -0,0 +1,189 @@
+"""共用資料存取層：把 CSV 一次轉成具型別的二進位格式，之後直接 memory-map 載入
+
+- ratings_*.csv → 每欄一個 .npy（user_id/anime_id 為 int32、rating 為 int8），以 mmap 開啟
+- anime_clean.csv → pickle（genre/type 為 category），保留 dtype
+- 來源 CSV 的 size / mtime 改變時自動重新轉換
+
+用法：
+    from src.pipeline.data_store import load_anime, load_ratings
+    anime = load_anime()
+    ratings_train = load_ratings("train")
+
+預先轉換全部資料：python -m src.pipeline.data_store
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.getenv("ANIME_DATA_DIR", "/usr/mlflow/data")
+BINARY_DIR = os.path.join(DATA_DIR, "binary")
+FORMAT_VERSION = 1
+
+ANIME_CSV = "anime_clean.csv"
+RATINGS_CSV = {
+    "train": "ratings_train.csv",
+    "test": "ratings_test.csv",
+    "clean": "ratings_clean.csv",
+}
+
+ANIME_DTYPES = {
+    "anime_id": "int32",
+    "genre": "category",
+    "type": "category",
+    "rating": "float32",
+}
+RATINGS_DTYPES = {
+    "user_id": "int32",
+    "anime_id": "int32",
+    "rating": "int8",  # 評分範圍 -1 ~ 10
+}
+CHUNK_ROWS = 2_000_000
+
+
+def csv_path(name):
+    """回傳來源 CSV 路徑；name 可為 "anime" 或 RATINGS_CSV 的 key"""
+    return os.path.join(DATA_DIR, ANIME_CSV if name == "anime" else RATINGS_CSV[name])
+
+
+def as_text(series):
+    """把 (可能是 category 的) 文字欄位轉成一般字串，缺值補空字串"""
+    return series.astype("object").fillna("").astype(str)
+
+
+# === staleness 檢查 ===
+def _source_stat(path):
+    st = os.stat(path)
+    return {"source": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _manifest_path(target_dir):
+    return os.path.join(target_dir, "manifest.json")
+
+
+def _read_manifest(target_dir):
+    path = _manifest_path(target_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(target_dir, manifest):
+    path = _manifest_path(target_dir)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def is_stale(name):
+    """來源 CSV 是否比二進位版本新（或尚未轉換）"""
+    manifest = _read_manifest(os.path.join(BINARY_DIR, name))
+    if manifest is None or manifest.get("version") != FORMAT_VERSION:
+        return True
+    stat = _source_stat(csv_path(name))
+    return any(manifest.get(k) != v for k, v in stat.items())
+
+
+# === 轉換 ===
+def _count_rows(path):
+    """快速計算資料列數（不含 header），作為 memmap 預先配置的上限"""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(16 * 1024 * 1024), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines - 1 + (last != b"\n")
+
+
+def convert_ratings(name):
+    """以 chunk 串流讀取 ratings CSV，直接寫入預先配置好的 .npy memmap"""
+    src = csv_path(name)
+    target_dir = os.path.join(BINARY_DIR, name)
+    os.makedirs(target_dir, exist_ok=True)
+    stat = _source_stat(src)
+    capacity = max(_count_rows(src), 0)
+
+    arrays = {
+        col: np.lib.format.open_memmap(
+            os.path.join(target_dir, f"{col}.npy.tmp"), mode="w+", dtype=dtype, shape=(capacity,)
+        )
+        for col, dtype in RATINGS_DTYPES.items()
+    }
+    rows = 0
+    for chunk in pd.read_csv(src, usecols=list(RATINGS_DTYPES), dtype=RATINGS_DTYPES, chunksize=CHUNK_ROWS):
+        n = len(chunk)
+        for col, arr in arrays.items():
+            arr[rows:rows + n] = chunk[col].to_numpy()
+        rows += n
+    for arr in arrays.values():
+        arr.flush()
+    arrays.clear()
+    for col in RATINGS_DTYPES:
+        os.replace(os.path.join(target_dir, f"{col}.npy.tmp"), os.path.join(target_dir, f"{col}.npy"))
+
+    _write_manifest(target_dir, {**stat, "version": FORMAT_VERSION, "rows": rows, "dtypes": RATINGS_DTYPES})
+    print(f"💾 {stat['source']} → {target_dir} ({rows} rows)")
+
+
+def convert_anime():
+    src = csv_path("anime")
+    target_dir = os.path.join(BINARY_DIR, "anime")
+    os.makedirs(target_dir, exist_ok=True)
+    stat = _source_stat(src)
+
+    anime = pd.read_csv(src)
+    anime = anime.astype({k: v for k, v in ANIME_DTYPES.items() if k in anime.columns})
+    if "members" in anime.columns:
+        anime["members"] = pd.to_numeric(anime["members"], downcast="integer")
+
+    path = os.path.join(target_dir, "anime.pkl")
+    anime.to_pickle(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    _write_manifest(target_dir, {**stat, "version": FORMAT_VERSION, "rows": len(anime)})
+    print(f"💾 {stat['source']} → {target_dir} ({len(anime)} rows)")
+
+
+# === 載入 ===
+def load_anime(categorical=True):
+    """載入動畫清單；categorical=False 時 genre/type 轉回一般字串"""
+    if is_stale("anime"):
+        convert_anime()
+    anime = pd.read_pickle(os.path.join(BINARY_DIR, "anime", "anime.pkl"))
+    if not categorical:
+        for col in ("genre", "type"):
+            if col in anime.columns:
+                anime[col] = anime[col].astype("object")
+    return anime
+
+
+def load_ratings(name="train", mmap=True):
+    """載入評分資料 (user_id int32, anime_id int32, rating int8)
+
+    mmap=True 時欄位直接指向 memory-mapped 檔案（唯讀），幾乎不佔記憶體與載入時間。
+    """
+    if is_stale(name):
+        convert_ratings(name)
+    target_dir = os.path.join(BINARY_DIR, name)
+    rows = _read_manifest(target_dir)["rows"]
+    mode = "r" if mmap else None
+    columns = {col: np.load(os.path.join(target_dir, f"{col}.npy"), mmap_mode=mode)[:rows] for col in RATINGS_DTYPES}
+    return pd.DataFrame(columns, copy=False)
+
+
+def convert_all(force=False):
+    """轉換所有存在的來源 CSV"""
+    if os.path.exists(csv_path("anime")) and (force or is_stale("anime")):
+        convert_anime()
+    for name in RATINGS_CSV:
+        if os.path.exists(csv_path(name)) and (force or is_stale(name)):
+            convert_ratings(name)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把 anime / ratings CSV 轉成具型別的二進位格式")
+    parser.add_argument("--force", action="store_true", help="忽略 staleness 檢查，全部重新轉換")
+    args = parser.parse_args()
+    convert_all(force=args.force)
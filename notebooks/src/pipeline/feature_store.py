@@ -0,0 +1,153 @@
+"""TF-IDF 特徵快取：以內容雜湊為 key，跨 pipeline / sweep / notebook 重複使用已 fit 的結果
+
+key = sha256(輸入文字指紋, 特徵組法 recipe, vectorizer 參數, sklearn 版本)
+每個 entry 是一個資料夾：vectorizer.pkl + matrix.npz + meta.json
+總容量超過上限時，依最後使用時間 (LRU) 淘汰
+
+環境變數：
+    ANIME_FEATURE_STORE      快取位置（設為 "off" 可停用）
+    ANIME_FEATURE_STORE_MB   容量上限，預設 2048 MB
+"""
+import os
+import json
+import time
+import uuid
+import pickle
+import shutil
+import hashlib
+import pandas as pd
+import scipy.sparse as sp
+import sklearn
+import mlflow
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from src.pipeline.data_store import DATA_DIR
+
+FEATURE_STORE_DIR = os.getenv("ANIME_FEATURE_STORE", os.path.join(DATA_DIR, "feature_store"))
+MAX_BYTES = int(os.getenv("ANIME_FEATURE_STORE_MB", "2048")) * 1024 * 1024
+
+
+def fingerprint(features):
+    """輸入文字的內容指紋（逐列雜湊後再整體 sha256，與 index 無關）"""
+    hashed = pd.util.hash_pandas_object(pd.Series(features).reset_index(drop=True), index=False)
+    return hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest()
+
+
+class FeatureStore:
+    def __init__(self, root=FEATURE_STORE_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.last_hit = None
+
+    def key(self, features, recipe, params):
+        payload = json.dumps(
+            {"data": fingerprint(features), "recipe": recipe, "params": params, "sklearn": sklearn.__version__},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_or_fit(self, features, recipe, params):
+        """回傳 (TF-IDF 稀疏矩陣, vectorizer)；命中快取時直接從磁碟載入"""
+        key = self.key(features, recipe, params)
+        entry = os.path.join(self.root, key)
+        if os.path.exists(os.path.join(entry, "meta.json")):
+            try:
+                with open(os.path.join(entry, "vectorizer.pkl"), "rb") as f:
+                    vectorizer = pickle.load(f)
+                matrix = sp.load_npz(os.path.join(entry, "matrix.npz"))
+                os.utime(os.path.join(entry, "meta.json"))  # 更新 LRU 時間
+                self.hits += 1
+                self.last_hit = True
+                return matrix, vectorizer
+            except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+                shutil.rmtree(entry, ignore_errors=True)  # 損壞的 entry，重新 fit
+
+        vectorizer = TfidfVectorizer(**params)
+        matrix = vectorizer.fit_transform(features)
+        self._write(entry, vectorizer, matrix, {"recipe": recipe, "params": params, "shape": list(matrix.shape)})
+        self.misses += 1
+        self.last_hit = False
+        return matrix, vectorizer
+
+    def _write(self, entry, vectorizer, matrix, meta):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, "vectorizer.pkl"), "wb") as f:
+            pickle.dump(vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        sp.save_npz(os.path.join(tmp, "matrix.npz"), matrix.tocsr())
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "created": time.time()}, f, default=str)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # 其他 process 已經寫入相同 key
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=os.path.basename(entry))
+
+    def entries(self):
+        """回傳 [(key, bytes, last_used)]"""
+        if not os.path.isdir(self.root):
+            return []
+        result = []
+        for key in os.listdir(self.root):
+            entry = os.path.join(self.root, key)
+            meta = os.path.join(entry, "meta.json")
+            if key.startswith(".") or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            result.append((key, size, os.path.getmtime(meta)))
+        return result
+
+    def evict(self, keep=None):
+        """容量超過上限時，從最久沒用到的 entry 開始刪除"""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
+
+    def stats(self, prefix="feature_cache"):
+        lookups = self.hits + self.misses
+        return {
+            f"{prefix}_hits": self.hits,
+            f"{prefix}_misses": self.misses,
+            f"{prefix}_hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def log_stats(self, prefix="feature_cache"):
+        """把命中統計寫入目前的 MLflow run"""
+        if mlflow.active_run() is not None:
+            mlflow.log_metrics(self.stats(prefix))
+
+
+class _NoCache(FeatureStore):
+    """ANIME_FEATURE_STORE=off 時使用：每次都重新 fit，不寫入磁碟"""
+
+    def get_or_fit(self, features, recipe, params):
+        vectorizer = TfidfVectorizer(**params)
+        self.misses += 1
+        self.last_hit = False
+        return vectorizer.fit_transform(features), vectorizer
+
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = _NoCache() if FEATURE_STORE_DIR == "off" else FeatureStore()
+    return _default_store
+
+
+def fit_tfidf_cached(features, recipe, **params):
+    """以預設快取 fit TF-IDF：fit_tfidf_cached(texts, recipe="genre+type", stop_words="english", ...)"""
+    return default_store().get_or_fit(features, recipe, params)
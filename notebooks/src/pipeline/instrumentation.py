@@ -0,0 +1,232 @@
+"""分段量測：每個 stage 的 wall time、CPU time、RSS 與 Python 配置高峰，記錄成 MLflow metrics
+
+用法：
+    from src.pipeline.instrumentation import stage, instrumented, log_instrumentation
+
+    @instrumented()                 # 以函式名稱當 stage 名稱
+    def load_data(self): ...
+
+    with stage("cosine_similarity"):
+        sim = cosine_similarity(tfidf)
+
+    with start_run() as tracker:
+        log_instrumentation(tracker)  # stage/<name>/wall_s、cpu_s、rss_peak_mb ... 一次批次送出
+
+同名 stage 重複執行時會累加時間、記錄次數，記憶體取最大值。
+
+rss_peak_mb 是該 stage 期間的 RSS 高峰：進入 stage 時寫 "5" 到 /proc/self/clear_refs 重設 VmHWM，
+結束時讀 VmHWM（Linux 4.0+）。無法重設時（非 Linux、權限不足）改記 process_rss_hwm_mb，
+也就是行程啟動以來的高峰，不能當成單一 stage 的數值。
+高峰為整個行程的值，不同執行緒同時跑 stage 時會互相影響。
+
+環境變數：
+    ANIME_TRACEMALLOC=1   另外以 tracemalloc 記錄每個 stage 的 Python/numpy 配置高峰（有額外開銷）
+    ANIME_PROFILE=1       啟動取樣 profiler，run 結束時把 folded stacks 存成 artifact
+                          （可用 speedscope / flamegraph.pl 開啟）
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import threading
+import functools
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+TRACE_MEMORY = os.getenv("ANIME_TRACEMALLOC", "0") == "1"
+PROFILE = os.getenv("ANIME_PROFILE", "0") == "1"
+PROFILE_INTERVAL = float(os.getenv("ANIME_PROFILE_INTERVAL", "0.005"))
+
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}  # name → 累計結果（依第一次出現的順序）
+_profiler = None
+_rss_hwm = 0.0  # 各 stage 觀察到的最高 RSS（clear_refs 會重設核心的高水位，行程高峰要自己保留）
+
+
+def _rss_mb():
+    """目前的 RSS（Linux 讀 /proc，其他平台回傳 None）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+def _vm_hwm_mb():
+    """/proc/self/status 的 VmHWM（RSS 高水位，可由 clear_refs 重設）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_hwm():
+    """重設 RSS 高水位；不支援時回傳 False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_mb():
+    """行程啟動以來的 peak RSS（Linux 單位為 KB、macOS 為 bytes）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@contextmanager
+def stage(name):
+    """量測一段程式；可巢狀使用，內層 stage 的記憶體高峰會併入外層"""
+    global _profiler, _rss_hwm
+    if PROFILE and _profiler is None:
+        _profiler = SamplingProfiler(PROFILE_INTERVAL, threading.get_ident()).start()
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    if stack:
+        # 重設高水位前，先把外層 stage 到目前為止的高峰記下來
+        hwm = _vm_hwm_mb()
+        if hwm is not None:
+            stack[-1]["rss_child_peak"] = max(stack[-1]["rss_child_peak"], hwm)
+    frame = {"child_peak": 0, "rss_child_peak": 0.0}
+    stack.append(frame)
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    hwm_reset = _reset_hwm() and _vm_hwm_mb() is not None
+    rss_start = _rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        rss_end = _rss_mb()
+        result = {"wall_s": wall, "cpu_s": cpu}
+        if hwm_reset:
+            rss_peak = max(_vm_hwm_mb() or 0.0, frame["rss_child_peak"])
+            result["rss_peak_mb"] = rss_peak
+            _rss_hwm = max(_rss_hwm, rss_peak)
+        else:
+            result["process_rss_hwm_mb"] = _max_rss_mb()
+        if rss_start is not None and rss_end is not None:
+            result["rss_delta_mb"] = rss_end - rss_start
+        if tracemalloc.is_tracing():
+            py_peak = max(tracemalloc.get_traced_memory()[1], frame["child_peak"])
+            result["py_peak_mb"] = py_peak / 1024 / 1024
+        stack.pop()
+        if stack and "py_peak_mb" in result:
+            stack[-1]["child_peak"] = max(stack[-1]["child_peak"], py_peak)
+        if stack and hwm_reset:
+            stack[-1]["rss_child_peak"] = max(stack[-1]["rss_child_peak"], rss_peak)
+        _record(name, result)
+
+
+def instrumented(name=None):
+    """decorator 版本的 stage；name 預設為函式名稱"""
+
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _record(name, result):
+    with _lock:
+        total = _stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+        total["calls"] += 1
+        total["wall_s"] += result["wall_s"]
+        total["cpu_s"] += result["cpu_s"]
+        for key in ("rss_peak_mb", "process_rss_hwm_mb", "rss_delta_mb", "py_peak_mb"):
+            if key in result:
+                total[key] = max(total.get(key, float("-inf")), result[key])
+
+
+def stage_results(reset=False):
+    """回傳 {stage: {calls, wall_s, cpu_s, rss_peak_mb, ...}}"""
+    with _lock:
+        results = {name: dict(values) for name, values in _stages.items()}
+        if reset:
+            _stages.clear()
+    return results
+
+
+def stage_metrics(reset=False):
+    """轉成 MLflow metric：stage/<name>/<measure>"""
+    return {
+        f"stage/{name}/{key}": value
+        for name, values in stage_results(reset).items()
+        for key, value in values.items()
+    }
+
+
+def log_instrumentation(tracker):
+    """把目前累積的 stage 量測（以及 profiler 的 folded stacks）寫入 run，並清空累積結果"""
+    global _profiler
+    tracker.log_metrics(stage_metrics(reset=True))
+    tracker.log_metric("process/peak_rss_mb", max(_max_rss_mb(), _rss_hwm))
+    if _profiler is not None:
+        profiler, _profiler = _profiler, None
+        profiler.stop()
+        path = os.path.join(tempfile.mkdtemp(prefix="profile-"), "folded_stacks.txt")
+        profiler.dump(path)
+        tracker.log_artifact(path, artifact_path="profile")
+        tracker.log_metric("profile/samples", profiler.samples)
+
+
+class SamplingProfiler:
+    """背景執行緒定期抓取目標執行緒的 call stack，統計成 folded stacks（flame graph 格式）"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
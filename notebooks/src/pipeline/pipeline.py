@@ -1,35 +1,44 @@
-import os
-import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import mlflow
 
-DATA_DIR = "/usr/mlflow/data"
+from src.pipeline.data_store import load_anime, load_ratings, as_text
+from src.pipeline.feature_store import default_store, fit_tfidf_cached
+from src.pipeline.precision import DEFAULT_PRECISION, quantize, nbytes
+from src.pipeline.tracking import start_run
+from src.pipeline.instrumentation import stage, instrumented, log_instrumentation
 
 class AnimePipeline:
-    def __init__(self, sample_size=1000):
+    def __init__(self, sample_size=1000, precision=DEFAULT_PRECISION):
         self.sample_size = sample_size
+        self.precision = precision  # 相似度矩陣的儲存精度：float64 / float32 / float16 / int8
 
+    @instrumented()
     def load_data(self):
         """載入動畫資料，只取部分樣本確保 3 分鐘內可跑完"""
-        anime = pd.read_csv(os.path.join(DATA_DIR, "anime_clean.csv"))
-        ratings_train = pd.read_csv(os.path.join(DATA_DIR, "ratings_train.csv"))
+        anime = load_anime()
+        ratings_train = load_ratings("train")
 
         # 取樣，避免全量跑太久
         anime = anime.sample(self.sample_size, random_state=42).reset_index(drop=True)
         return anime, ratings_train
 
+    @instrumented()
     def train_model(self, anime, max_features=1000, ngram_range=(1,1), min_df=2):
         """用 TF-IDF 訓練 item-based 模型"""
-        vectorizer = TfidfVectorizer(
-            stop_words="english",
-            max_features=max_features,
-            ngram_range=ngram_range,
-            min_df=min_df
-        )
-        tfidf = vectorizer.fit_transform(anime["genre"].fillna(""))
-        sim_matrix = cosine_similarity(tfidf)
+        with stage("fit_tfidf"):
+            tfidf, vectorizer = fit_tfidf_cached(
+                as_text(anime["genre"]),
+                recipe="genre",
+                stop_words="english",
+                max_features=max_features,
+                ngram_range=ngram_range,
+                min_df=min_df
+            )
+        # float32 計算後依 self.precision 儲存（int8 時每列一個 scale，取列時自動還原）
+        with stage("cosine_similarity"):
+            # float64 基準線要以 float64 計算，其餘精度以 float32 計算後再量化（同 precision._neighbors）
+            compute_dtype = np.float64 if self.precision == "float64" else np.float32
+            sim_matrix = quantize(cosine_similarity(tfidf.astype(compute_dtype)), self.precision)
         return sim_matrix
 
     def evaluate_and_log(self, anime, sim_matrix, params):
@@ -38,23 +47,28 @@ class AnimePipeline:
             return len(set(recommended[:k]) & set(relevant)) / k
 
         # 隨機測 30 部動畫，控制時間
-        test_idx = np.random.choice(len(anime), 30, replace=False)
-        scores = []
-        for idx in test_idx:
-            sim_scores = list(enumerate(sim_matrix[idx]))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            top_idx = [i for i, _ in sim_scores[1:11]]
-            recommended = anime.iloc[top_idx]["name"].tolist()
-            relevant = anime[anime["genre"] == anime.iloc[idx]["genre"]]["name"].tolist()
-            if len(relevant) > 1:
-                scores.append(precision_at_k(recommended, relevant, k=10))
-
-        avg_precision = np.mean(scores)
-
-        with mlflow.start_run(run_name="pipeline-tfidf") as run:
-            mlflow.log_params(params)          # 紀錄參數
-            mlflow.log_metric("precision_at_10", avg_precision)  # 紀錄指標
-            print("Run ID:", run.info.run_id)
-            print("Artifact URI:", run.info.artifact_uri)
+        with stage("evaluate"):
+            test_idx = np.random.choice(len(anime), 30, replace=False)
+            scores = []
+            for idx in test_idx:
+                sim_scores = list(enumerate(sim_matrix[idx]))
+                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+                top_idx = [i for i, _ in sim_scores[1:11]]
+                recommended = anime.iloc[top_idx]["name"].tolist()
+                relevant = anime[anime["genre"] == anime.iloc[idx]["genre"]]["name"].tolist()
+                if len(relevant) > 1:
+                    scores.append(precision_at_k(recommended, relevant, k=10))
+
+            avg_precision = np.mean(scores)
+
+        with start_run(run_name="pipeline-tfidf") as tracker:
+            tracker.log_params(params)          # 紀錄參數（run 結束前批次送出）
+            tracker.log_param("precision", self.precision)
+            tracker.log_metric("sim_matrix_mb", nbytes(sim_matrix) / 1024 / 1024)
+            tracker.log_metric("precision_at_10", avg_precision)  # 紀錄指標
+            tracker.log_metrics(default_store().stats())  # 特徵快取命中率
+            log_instrumentation(tracker)  # 各 stage 的時間 / 記憶體
+            print("Run ID:", tracker.run.info.run_id)
+            print("Artifact URI:", tracker.run.info.artifact_uri)
 
         return avg_precision
\ No newline at end of file
@@ -1,39 +1,55 @@
-import os
-import json
-import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import mlflow
 
-DATA_DIR = "/usr/mlflow/data"
+from src.pipeline.data_store import load_anime, load_ratings, as_text
+from src.pipeline.feature_store import default_store, fit_tfidf_cached
+from src.pipeline.precision import DEFAULT_PRECISION, quantize, nbytes
+from src.pipeline.tracking import start_run
+from src.pipeline.instrumentation import stage, instrumented, log_instrumentation
 
 class AnimePipelineV3:
-    def __init__(self, sample_size=1000):
+    def __init__(self, sample_size=1000, precision=DEFAULT_PRECISION):
         self.sample_size = sample_size
+        self.precision = precision  # 相似度矩陣的儲存精度：float64 / float32 / float16 / int8
 
+    @instrumented()
     def load_data(self):
         """載入動畫資料，只取部分樣本確保 3 分鐘內可跑完"""
-        anime = pd.read_csv(os.path.join(DATA_DIR, "anime_clean.csv"))
-        ratings_train = pd.read_csv(os.path.join(DATA_DIR, "ratings_train.csv"))
-        anime = anime.sample(self.sample_size, random_state=42).reset_index(drop=True)
+        anime = load_anime()
+        ratings_train = load_ratings("train")
+        if self.sample_size:  # sample_size=None → 使用完整目錄
+            anime = anime.sample(self.sample_size, random_state=42).reset_index(drop=True)
         return anime, ratings_train
 
-    def train_model(self, anime, max_features=1000, ngram_range=(1,1), min_df=2, use_type=True):
-        """用 TF-IDF 訓練 item-based 模型，可以選擇是否加入 type 特徵"""
+    def build_features(self, anime, use_type=True):
+        """組出 TF-IDF 的輸入文字：genre，可選擇加上 type"""
         if use_type:
-            anime["features"] = anime["genre"].fillna("") + " " + anime["type"].fillna("")
-        else:
-            anime["features"] = anime["genre"].fillna("")
-
-        vectorizer = TfidfVectorizer(
+            return as_text(anime["genre"]) + " " + as_text(anime["type"])
+        return as_text(anime["genre"])
+
+    @instrumented()
+    def fit_tfidf(self, features, max_features=1000, ngram_range=(1,1), min_df=2, recipe="genre+type"):
+        """回傳 (TF-IDF 稀疏矩陣, vectorizer)；相同輸入與參數直接取用特徵快取"""
+        return fit_tfidf_cached(
+            features,
+            recipe=recipe,
             stop_words="english",
             max_features=max_features,
             ngram_range=ngram_range,
             min_df=min_df
         )
-        tfidf = vectorizer.fit_transform(anime["features"])
-        sim_matrix = cosine_similarity(tfidf)
+
+    @instrumented()
+    def train_model(self, anime, max_features=1000, ngram_range=(1,1), min_df=2, use_type=True):
+        """用 TF-IDF 訓練 item-based 模型，可以選擇是否加入 type 特徵"""
+        anime["features"] = self.build_features(anime, use_type)
+        recipe = "genre+type" if use_type else "genre"
+        tfidf, vectorizer = self.fit_tfidf(anime["features"], max_features, ngram_range, min_df, recipe)
+        # float32 計算後依 self.precision 儲存（int8 時每列一個 scale，取列時自動還原）
+        with stage("cosine_similarity"):
+            # float64 基準線要以 float64 計算，其餘精度以 float32 計算後再量化（同 precision._neighbors）
+            compute_dtype = np.float64 if self.precision == "float64" else np.float32
+            sim_matrix = quantize(cosine_similarity(tfidf.astype(compute_dtype)), self.precision)
         return sim_matrix
 
     def predict(self, anime, sim_matrix, title, top_k=10):
@@ -55,40 +71,42 @@ class AnimePipelineV3:
         def precision_at_k(recommended, relevant, k=10):
             return len(set(recommended[:k]) & set(relevant)) / k
 
-        test_idx = np.random.choice(len(anime), 30, replace=False)
-        scores = []
-        examples = []
-
-        for idx in test_idx[:5]:  # 只存 5 筆範例，避免 artifacts 太大
-            sim_scores = list(enumerate(sim_matrix[idx]))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            top_idx = [i for i, _ in sim_scores[1:11]]
-            recommended = anime.iloc[top_idx]["name"].tolist()
-            relevant = anime[anime["genre"] == anime.iloc[idx]["genre"]]["name"].tolist()
-            if len(relevant) > 1:
-                scores.append(precision_at_k(recommended, relevant, k=10))
-
-            # 存成統一格式
-            examples.append({
-                "input": anime.iloc[idx]["name"],
-                "recommendations": recommended
-            })
-
-        avg_precision = np.mean(scores)
-
-        with mlflow.start_run(run_name="pipeline-v3") as run:
-            mlflow.log_params(params)
-            mlflow.log_metric("precision_at_10", avg_precision)
-
-            result_path = "recommendations.json"
-            with open(result_path, "w", encoding="utf-8") as f:
-                json.dump(examples, f, ensure_ascii=False, indent=2)
-            mlflow.log_artifact(result_path)
-
-            # mlflow.log_dict()，直接把 dict 存成 JSON
-            mlflow.log_dict({"examples": examples}, "recommendations_dict.json")
-
-            print("Run ID:", run.info.run_id)
-            print("Artifact URI:", run.info.artifact_uri)
+        with stage("evaluate"):
+            test_idx = np.random.choice(len(anime), 30, replace=False)
+            scores = []
+            examples = []
+
+            for idx in test_idx[:5]:  # 只存 5 筆範例，避免 artifacts 太大
+                sim_scores = list(enumerate(sim_matrix[idx]))
+                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+                top_idx = [i for i, _ in sim_scores[1:11]]
+                recommended = anime.iloc[top_idx]["name"].tolist()
+                relevant = anime[anime["genre"] == anime.iloc[idx]["genre"]]["name"].tolist()
+                if len(relevant) > 1:
+                    scores.append(precision_at_k(recommended, relevant, k=10))
+
+                # 存成統一格式
+                examples.append({
+                    "input": anime.iloc[idx]["name"],
+                    "recommendations": recommended
+                })
+
+            avg_precision = np.mean(scores)
+
+        # params / metrics 以 log_batch 批次送出，artifacts 在背景上傳，run 結束前自動 flush
+        with start_run(run_name="pipeline-v3") as tracker:
+            tracker.log_params(params)
+            tracker.log_param("precision", self.precision)
+            tracker.log_metric("sim_matrix_mb", nbytes(sim_matrix) / 1024 / 1024)
+            tracker.log_metric("precision_at_10", avg_precision)
+            tracker.log_metrics(default_store().stats())  # 特徵快取命中率
+            log_instrumentation(tracker)  # 各 stage 的時間 / 記憶體
+
+            # 推論範例寫到暫存資料夾再上傳，不會在工作目錄留下 recommendations.json
+            tracker.log_dict(examples, "recommendations.json")
+            tracker.log_dict({"examples": examples}, "recommendations_dict.json")
+
+            print("Run ID:", tracker.run.info.run_id)
+            print("Artifact URI:", tracker.run.info.artifact_uri)
 
         return avg_precision
\ No newline at end of file
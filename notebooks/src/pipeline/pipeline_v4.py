@@ -1,69 +1,84 @@
 import os
-import json
-import pandas as pd
+import tempfile
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import mlflow
 
-DATA_DIR = "/usr/mlflow/data"
+from src.pipeline.data_store import load_anime, as_text
+from src.pipeline.explain import build_explanations
+from src.pipeline.feature_store import default_store, fit_tfidf_cached
+from src.pipeline.precision import DEFAULT_PRECISION, quantize
+from src.pipeline.tracking import start_run
+from src.pipeline.instrumentation import stage, instrumented, log_instrumentation
 
 class AnimePipelineV4:
-    def __init__(self, sample_size=500):
+    def __init__(self, sample_size=500, precision=DEFAULT_PRECISION):
         # 抽樣確保速度快
         self.sample_size = sample_size
+        self.precision = precision  # 相似度矩陣的儲存精度：float64 / float32 / float16 / int8
 
+    @instrumented()
     def load_data(self):
-        anime = pd.read_csv(os.path.join(DATA_DIR, "anime_clean.csv"))
-        anime = anime.sample(self.sample_size, random_state=42).reset_index(drop=True)
+        anime = load_anime()
+        if self.sample_size:  # sample_size=None → 使用完整目錄
+            anime = anime.sample(self.sample_size, random_state=42).reset_index(drop=True)
         return anime
 
-    def train_model(self, anime, max_features=500, ngram_range=(1,1), min_df=2, use_type=True):
+    def build_features(self, anime, use_type=True):
+        """組出 TF-IDF 的輸入文字：genre，可選擇加上 type"""
         if use_type:
-            anime["features"] = anime["genre"].fillna("") + " " + anime["type"].fillna("")
-        else:
-            anime["features"] = anime["genre"].fillna("")
+            return as_text(anime["genre"]) + " " + as_text(anime["type"])
+        return as_text(anime["genre"])
 
-        vectorizer = TfidfVectorizer(
+    @instrumented()
+    def fit_tfidf(self, features, max_features=500, ngram_range=(1,1), min_df=2, recipe="genre+type"):
+        """回傳 (TF-IDF 稀疏矩陣, vectorizer)；相同輸入與參數直接取用特徵快取"""
+        return fit_tfidf_cached(
+            features,
+            recipe=recipe,
             stop_words="english",
             max_features=max_features,
             ngram_range=ngram_range,
             min_df=min_df
         )
-        tfidf = vectorizer.fit_transform(anime["features"])
-        sim_matrix = cosine_similarity(tfidf)
+
+    @instrumented()
+    def train_model(self, anime, max_features=500, ngram_range=(1,1), min_df=2, use_type=True):
+        anime["features"] = self.build_features(anime, use_type)
+        recipe = "genre+type" if use_type else "genre"
+        tfidf, vectorizer = self.fit_tfidf(anime["features"], max_features, ngram_range, min_df, recipe)
+        # float32 計算後依 self.precision 儲存（int8 時每列一個 scale，取列時自動還原）
+        with stage("cosine_similarity"):
+            # float64 基準線要以 float64 計算，其餘精度以 float32 計算後再量化（同 precision._neighbors）
+            compute_dtype = np.float64 if self.precision == "float64" else np.float32
+            sim_matrix = quantize(cosine_similarity(tfidf.astype(compute_dtype)), self.precision)
         return sim_matrix, vectorizer
 
     def explain_and_log(self, anime, vectorizer, params):
-        """同時輸出 單一樣本 + 全資料集 平均特徵重要性"""
-        feature_names = vectorizer.get_feature_names_out()
-
-        # ✅ 單一樣本 (第一筆動畫)
-        tfidf_vector = vectorizer.transform([anime.iloc[0]["features"]]).toarray()[0]
-        sample_importance = sorted(
-            zip(feature_names, tfidf_vector),
-            key=lambda x: abs(x[1]),
-            reverse=True
-        )[:10]
-        sample_dict = {f: float(v) for f, v in sample_importance}
+        """同時輸出 單一樣本 + 全資料集 平均特徵重要性；整個目錄的逐項解釋另存成 item_explanations.npz"""
+        with stage("explain"):
+            # ✅ 一次算出每部動畫的前 10 個詞（直接在 CSR 上取 top-N，不轉稠密矩陣）
+            tfidf_matrix = vectorizer.transform(anime["features"])
+            explanations = build_explanations(
+                anime["anime_id"], tfidf_matrix, vectorizer.get_feature_names_out(), top_n=10
+            )
 
-        # ✅ 全資料集平均權重
-        tfidf_matrix = vectorizer.transform(anime["features"])
-        avg_weights = np.asarray(tfidf_matrix.mean(axis=0)).flatten()
-        global_importance = sorted(
-            zip(feature_names, avg_weights),
-            key=lambda x: abs(x[1]),
-            reverse=True
-        )[:10]
-        global_dict = {f: float(v) for f, v in global_importance}
+            # ✅ 單一樣本 (第一筆動畫) + 全資料集平均權重
+            sample_dict = {e["term"]: e["weight"] for e in explanations.explain(anime.iloc[0]["anime_id"])}
+            global_dict = {e["term"]: e["weight"] for e in explanations.explain_global()}
+            explain_path = os.path.join(tempfile.mkdtemp(prefix="explain-"), "item_explanations.npz")
+            explanations.save(explain_path)
 
         # ✅ 存到 MLflow
-        with mlflow.start_run(run_name="pipeline-v4-explain") as run:
-            mlflow.log_params(params)
-            mlflow.log_dict(sample_dict, "sample_feature_importance.json")
-            mlflow.log_dict(global_dict, "global_feature_importance.json")
+        with start_run(run_name="pipeline-v4-explain") as tracker:
+            tracker.log_params(params)
+            tracker.log_param("precision", self.precision)
+            tracker.log_dict(sample_dict, "sample_feature_importance.json")
+            tracker.log_dict(global_dict, "global_feature_importance.json")
+            tracker.log_artifact(explain_path)
+            tracker.log_metrics(default_store().stats())  # 特徵快取命中率
+            log_instrumentation(tracker)  # 各 stage 的時間 / 記憶體
 
-            print("Run ID:", run.info.run_id)
-            print("Artifacts URI:", run.info.artifact_uri)
+            print("Run ID:", tracker.run.info.run_id)
+            print("Artifacts URI:", tracker.run.info.artifact_uri)
 
         return sample_dict, global_dict
@@ -0,0 +1,281 @@
+"""物品向量 / 相似度矩陣的儲存精度：float64、float32、float16、int8（每列一個 scale）
+
+- float32 / float16：直接轉型，記憶體為 float64 的 1/2、1/4
+- int8：每列以 max|x| / 127 為 scale 量化，記憶體約為 1/8（另加每列 4 bytes 的 scale）
+- 稠密陣列與稀疏矩陣都適用；int8 / float16 稀疏矩陣包成 PackedCSR、int8 稠密矩陣包成 QuantizedRows，
+  取列 / 內積時自動還原成 float32
+
+訓練端（pipelines、train_item_based、day12、TFIDFRecommender artifact）與 serving 端使用同一套函式，
+精度預設由環境變數 ANIME_VECTOR_PRECISION 決定（預設 float32）。
+
+精度 vs 準確度報告：python -m src.pipeline.precision --sample 2000
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+PRECISIONS = ("float64", "float32", "float16", "int8")
+DEFAULT_PRECISION = os.getenv("ANIME_VECTOR_PRECISION", "float32")
+INT8_MAX = 127
+
+
+def _check(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision 必須是 {PRECISIONS} 之一，收到 {precision!r}")
+
+
+class QuantizedRows:
+    """int8 量化後的稠密矩陣，每列一個 float32 scale"""
+
+    def __init__(self, values, scale):
+        self.values = values
+        self.scale = scale
+        self.shape = values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scale.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        """單一列 → 還原成 float32 的 1-D 陣列（與原本 sim_matrix[idx] 用法相同）"""
+        if np.ndim(idx) == 0:
+            return self.values[idx].astype(np.float32) * self.scale[idx]
+        return QuantizedRows(self.values[idx], self.scale[idx])
+
+    def dot(self, q_vec, rows=None):
+        values = self.values if rows is None else self.values[rows]
+        scale = self.scale if rows is None else self.scale[rows]
+        q = q_vec.toarray() if sp.issparse(q_vec) else np.asarray(q_vec)
+        return (values.astype(np.float32) @ q.astype(np.float32).ravel()) * scale
+
+    def to_float(self, dtype=np.float32):
+        return self.values.astype(dtype) * self.scale[:, None].astype(dtype)
+
+
+class PackedCSR:
+    """float16 或 int8（每列 scale）的 CSR；scipy.sparse 不支援這兩種 dtype，
+    因此自行保存 data / indices / indptr，需要運算時才把選到的列還原成 float32 CSR"""
+
+    def __init__(self, data, indices, indptr, shape, scale=None):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(int(x) for x in shape)
+        self.scale = scale
+
+    @property
+    def nbytes(self):
+        extra = self.scale.nbytes if self.scale is not None else 0
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes + extra
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _select(self, rows):
+        """回傳 (nnz 位置, 新 indptr)"""
+        rows = np.asarray(rows)
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - starts, lengths)
+        return positions, indptr
+
+    def to_csr(self, rows=None, dtype=np.float32):
+        if rows is None:
+            positions, indptr, n_rows = slice(None), self.indptr, self.shape[0]
+            row_of_nnz = np.repeat(np.arange(n_rows), np.diff(indptr))
+        else:
+            positions, indptr = self._select(rows)
+            n_rows = len(indptr) - 1
+            row_of_nnz = np.repeat(np.asarray(rows), np.diff(indptr))
+        data = self.data[positions].astype(dtype)
+        if self.scale is not None:
+            data *= self.scale[row_of_nnz]
+        return sp.csr_matrix((data, self.indices[positions], indptr), shape=(n_rows, self.shape[1]))
+
+    def __getitem__(self, idx):
+        if np.ndim(idx) == 0:
+            return self.to_csr([idx]).toarray().ravel()
+        positions, indptr = self._select(idx)
+        scale = None if self.scale is None else self.scale[idx]
+        return PackedCSR(self.data[positions], self.indices[positions], indptr, (len(indptr) - 1, self.shape[1]), scale)
+
+    def dot(self, q_vec, rows=None):
+        return (self.to_csr(rows) @ sp.csr_matrix(q_vec, dtype=np.float32).T).toarray().ravel()
+
+    def to_float(self, dtype=np.float32):
+        return self.to_csr(dtype=dtype)
+
+
+def _row_scale(row_max):
+    return np.where(row_max > 0, row_max / INT8_MAX, 1.0).astype(np.float32)
+
+
+def quantize(matrix, precision=DEFAULT_PRECISION):
+    """把稠密陣列或稀疏矩陣轉成指定精度
+
+    稠密：float* → ndarray，int8 → QuantizedRows
+    稀疏：float32/64 → scipy CSR，float16 / int8 → PackedCSR
+    """
+    _check(precision)
+    if sp.issparse(matrix):
+        if precision in ("float32", "float64"):
+            return sp.csr_matrix(matrix, dtype=precision)
+        matrix = sp.csr_matrix(matrix, dtype=np.float32)
+        if precision == "float16":
+            return PackedCSR(matrix.data.astype(np.float16), matrix.indices, matrix.indptr, matrix.shape)
+        lengths = np.diff(matrix.indptr)
+        row_max = np.zeros(matrix.shape[0], dtype=np.float32)
+        np.maximum.at(row_max, np.repeat(np.arange(matrix.shape[0]), lengths), np.abs(matrix.data))
+        scale = _row_scale(row_max)
+        data = np.rint(matrix.data / np.repeat(scale, lengths)).astype(np.int8)
+        return PackedCSR(data, matrix.indices, matrix.indptr, matrix.shape, scale)
+
+    if precision != "int8":
+        return np.asarray(matrix).astype(precision)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    row_max = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+    scale = _row_scale(row_max)
+    return QuantizedRows(np.rint(matrix / scale[:, None]).astype(np.int8), scale)
+
+
+def dequantize(matrix, dtype=np.float32):
+    """還原成 float 的 ndarray / scipy CSR（報告或需要完整矩陣運算時使用）"""
+    if isinstance(matrix, (QuantizedRows, PackedCSR)):
+        return matrix.to_float(dtype)
+    return matrix.astype(dtype)
+
+
+def precision_of(matrix):
+    if isinstance(matrix, QuantizedRows):
+        return "int8"
+    if isinstance(matrix, PackedCSR):
+        return "int8" if matrix.scale is not None else "float16"
+    return np.dtype(matrix.dtype).name
+
+
+def nbytes(matrix):
+    if isinstance(matrix, (QuantizedRows, PackedCSR)):
+        return matrix.nbytes
+    if sp.issparse(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def row_scores(matrix, q_vec, rows=None):
+    """每列與查詢向量的內積（TF-IDF 已 L2 normalize → cosine），回傳 1-D 陣列"""
+    if isinstance(matrix, (QuantizedRows, PackedCSR)):
+        return matrix.dot(q_vec, rows)
+    sub = matrix if rows is None else matrix[rows]
+    if sp.issparse(sub):
+        return (sub @ sp.csr_matrix(q_vec, dtype=sub.dtype).T).toarray().ravel()
+    return sub @ np.asarray(q_vec.toarray() if sp.issparse(q_vec) else q_vec, dtype=sub.dtype).ravel()
+
+
+def save_rows(path, matrix):
+    """稀疏物品向量（任一精度）存成單一 .npz"""
+    if not isinstance(matrix, PackedCSR):
+        matrix = sp.csr_matrix(matrix)
+    arrays = {
+        "precision": np.array(precision_of(matrix)),
+        "data": matrix.data,
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+        "shape": np.array(matrix.shape),
+    }
+    if getattr(matrix, "scale", None) is not None:
+        arrays["scale"] = matrix.scale
+    np.savez(path, **arrays)
+
+
+def load_rows(path):
+    """讀回 save_rows 的結果；也相容舊版以 sp.save_npz 存的 float64 矩陣"""
+    with np.load(path) as data:
+        if "precision" not in data.files:
+            return sp.load_npz(path).tocsr()
+        precision = str(data["precision"])
+        shape = tuple(data["shape"])
+        if precision in ("float16", "int8"):
+            scale = data["scale"] if "scale" in data.files else None
+            return PackedCSR(data["data"], data["indices"], data["indptr"], shape, scale)
+        return sp.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=shape)
+
+
+# === 精度 vs 準確度報告 ===
+def _neighbors(tfidf, precision, k, batch=512):
+    """以指定精度儲存相似度後，取每個物品的 Top-k 鄰居（排除自己）"""
+    n = tfidf.shape[0]
+    tfidf = sp.csr_matrix(tfidf, dtype=np.float64 if precision == "float64" else np.float32)
+    result = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, batch):
+        stop = min(start + batch, n)
+        sim = np.asarray((tfidf[start:stop] @ tfidf.T).todense())
+        sim = dequantize(quantize(sim, precision))
+        sim[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sim, top, axis=1), axis=1, kind="stable")
+        result[start:stop] = np.take_along_axis(top, order, axis=1)
+    return result
+
+
+def precision_report(anime, tfidf, k=10, precisions=PRECISIONS):
+    """比較各精度的 Top-k 鄰居重疊率、genre Precision@k 與記憶體"""
+    genre = pd.Series(anime["genre"].astype("object").fillna("").to_numpy())
+    codes = pd.factorize(genre)[0]
+    has_peer = np.bincount(codes)[codes] > 1
+    n = tfidf.shape[0]
+    reference = None
+    rows = []
+    for precision in precisions:
+        neighbors = _neighbors(tfidf, precision, k)
+        if reference is None:
+            reference = neighbors
+        overlap = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(neighbors, reference)])
+        genre_precision = (codes[neighbors] == codes[:, None]).mean(axis=1)[has_peer].mean()
+        itemsize = 1 if precision == "int8" else np.dtype(precision).itemsize
+        rows.append({
+            "precision": precision,
+            f"overlap_at_{k}_vs_{precisions[0]}": overlap,
+            f"precision_at_{k}": genre_precision,
+            "sim_matrix_mb": (n * n * itemsize + (n * 4 if precision == "int8" else 0)) / 1024 / 1024,
+            "item_vectors_mb": nbytes(quantize(tfidf, precision)) / 1024 / 1024,
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from src.pipeline.data_store import load_anime, as_text
+    from src.pipeline.feature_store import fit_tfidf_cached
+
+    parser = argparse.ArgumentParser(description="物品向量精度 vs 準確度 / 記憶體報告")
+    parser.add_argument("--sample", type=int, default=None, help="抽樣筆數（預設使用完整目錄）")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--log", action="store_true", help="把報告記錄到 MLflow")
+    args = parser.parse_args()
+
+    anime = load_anime()
+    if args.sample:
+        anime = anime.sample(min(args.sample, len(anime)), random_state=42).reset_index(drop=True)
+    features = as_text(anime["genre"]) + " " + as_text(anime["type"])
+    tfidf, _ = fit_tfidf_cached(features, recipe="genre+type", stop_words="english")
+
+    report = precision_report(anime, tfidf, args.k)
+    print(report.round(4).to_string(index=False))
+
+    if args.log:
+        import mlflow
+        from src.pipeline.tracking import tracking_uri, start_run
+
+        mlflow.set_tracking_uri(tracking_uri())
+        mlflow.set_experiment("anime-recsys-precision")
+        with start_run(run_name="precision-report") as tracker:
+            tracker.log_params({"n_items": len(anime), "k": args.k})
+            for row in report.to_dict(orient="records"):
+                precision = row.pop("precision")
+                tracker.log_metrics({f"{precision}_{key}": value for key, value in row.items()})
+            tracker.log_dict(report.to_dict(orient="records"), "precision_report.json")
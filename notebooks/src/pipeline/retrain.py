@@ -1,44 +1,148 @@
 import os
-import pandas as pd
-import numpy as np
+import io
+import sys
 import json
+import hashlib
+import pandas as pd
 import mlflow
 import mlflow.pyfunc
 from mlflow.tracking import MlflowClient
 
+# 以 `python src/pipeline/retrain.py` 執行時，讓 src.pipeline 可被 import
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from src.pipeline.data_store import csv_path, load_anime
+from src.pipeline.tracking import start_run, tracking_uri
+from src.pipeline.instrumentation import stage, log_instrumentation
+
 # === MLflow Tracking 設定 ===
-mlflow.set_tracking_uri("http://mlflow:5000")
+mlflow.set_tracking_uri(tracking_uri())
 mlflow.set_experiment("anime-recsys-cicd")
 
 client = MlflowClient()
 
-# === 載入資料 ===
-DATA_DIR = "/usr/mlflow/data"
-anime = pd.read_csv(os.path.join(DATA_DIR, "anime_clean.csv"))
-ratings_train = pd.read_csv(os.path.join(DATA_DIR, "ratings_train.csv"))
-
-# === Step 1: 計算平均分數 ===
-agg = (
-    ratings_train.groupby("anime_id")["rating"]
-    .mean()
-    .reset_index()
-    .merge(anime[["anime_id", "name"]], on="anime_id")
-)
-
-# === Step 2: 熱門前 7 ===
-top7 = agg.sort_values("rating", ascending=False).head(7)
-
-# === Step 3: 隨機選 3 部 ===
-random_seed = np.random.randint(0, 100000)
-np.random.seed(random_seed)
-random3 = agg.sample(3)
-
-# === Step 4: 組合 Top10 ===
-top10 = pd.concat([top7, random3]).drop_duplicates("anime_id").head(10)
-top10_ids = top10["anime_id"].tolist()
-top10_names = top10["name"].tolist()
-print(f"Random Seed: {random_seed}")
-print("Top 10 Anime:", top10_names)
+# === 路徑設定 ===
+# ratings_train.csv 會被持續 append，因此增量讀取直接針對 CSV 尾端；
+# anime 清單則透過共用的二進位資料層載入
+ANIME_PATH = csv_path("anime")
+RATINGS_PATH = csv_path("train")
+DATA_DIR = os.path.dirname(RATINGS_PATH)
+
+# 增量狀態：每部動畫的 sum / count + 已處理到的 byte offset
+STATE_DIR = os.path.join(DATA_DIR, "retrain_state")
+STATE_PATH = os.path.join(STATE_DIR, "state.json")
+AGG_PATH = os.path.join(STATE_DIR, "anime_rating_agg.csv")
+
+BLOCK_SIZE = 64 * 1024 * 1024  # 每次最多讀 64MB，避免全量載入
+PROBE_SIZE = 64 * 1024         # 用來判斷檔案是否被改寫的取樣長度
+
+
+def file_sha256(path):
+    """計算整個檔案的內容雜湊（anime_clean.csv 很小，直接全讀）"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_probe(path, end):
+    """讀取 offset 前一小段內容的雜湊，用來確認舊資料沒有被改寫"""
+    with open(path, "rb") as f:
+        f.seek(max(0, end - PROBE_SIZE))
+        return hashlib.sha256(f.read(min(end, PROBE_SIZE))).hexdigest()
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH) or not os.path.exists(AGG_PATH):
+        return None
+    with open(STATE_PATH, encoding="utf-8") as f:
+        state = json.load(f)
+    agg = pd.read_csv(AGG_PATH, index_col="anime_id")
+    return state, agg
+
+
+def save_state(state, agg):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    # 先寫暫存檔再 rename，避免中途中斷留下半份狀態
+    agg.to_csv(AGG_PATH + ".tmp")
+    os.replace(AGG_PATH + ".tmp", AGG_PATH)
+    with open(STATE_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+
+def iter_blocks(path, start, end):
+    """依行切割讀取 [start, end) 區間的 bytes"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        carry = b""
+        while pos < end:
+            data = f.read(min(BLOCK_SIZE, end - pos))
+            if not data:
+                break
+            pos += len(data)
+            data = carry + data
+            cut = data.rfind(b"\n") + 1
+            carry = data[cut:]
+            if cut:
+                yield data[:cut]
+        if carry:
+            yield carry
+
+
+def fold_ratings(path, start, end, columns, agg, digest):
+    """把新增的評分累加進 per-anime sum / count，同時更新輸入雜湊"""
+    for block in iter_blocks(path, start, end):
+        digest.update(block)
+        chunk = pd.read_csv(io.BytesIO(block), header=None, names=columns, usecols=["anime_id", "rating"])
+        part = chunk.groupby("anime_id")["rating"].agg(["sum", "count"])
+        agg = agg.add(part, fill_value=0)
+    return agg
+
+
+def scan_ratings(state):
+    """回傳 (agg, 新狀態, 是否為全量重算)；只有在檔案被改寫時才全量重算"""
+    size = os.path.getsize(RATINGS_PATH)
+    with open(RATINGS_PATH, "rb") as f:
+        header = f.readline()
+        # 只處理到最後一個完整的行，避免讀到寫入中的半行
+        f.seek(max(len(header), size - PROBE_SIZE))
+        tail = f.read()
+    end = size - (len(tail) - tail.rfind(b"\n") - 1) if b"\n" in tail else len(header)
+    columns = header.decode("utf-8").strip().split(",")
+
+    previous, agg = state if state else (None, None)
+    incremental = (
+        previous is not None
+        and previous["header"] == columns
+        and previous["offset"] <= end
+        and previous["probe"] == read_probe(RATINGS_PATH, previous["offset"])
+    )
+    if incremental:
+        start = previous["offset"]
+        digest = hashlib.sha256(bytes.fromhex(previous["ratings_hash"]))
+    else:
+        start = len(header)
+        agg = pd.DataFrame(columns=["sum", "count"], dtype="float64")
+        agg.index.name = "anime_id"
+        digest = hashlib.sha256(header)
+
+    if start < end:
+        agg = fold_ratings(RATINGS_PATH, start, end, columns, agg, digest)
+        ratings_hash = digest.hexdigest()
+    else:
+        ratings_hash = previous["ratings_hash"] if incremental else digest.hexdigest()
+
+    scan = {
+        "header": columns,
+        "offset": end,
+        "probe": read_probe(RATINGS_PATH, end),
+        "ratings_hash": ratings_hash,
+        "new_bytes": end - start,
+    }
+    return agg, scan, not incremental
+
 
 # === PopularTop10 模型定義 ===
 class PopularTop10(mlflow.pyfunc.PythonModel):
@@ -49,34 +153,92 @@ class PopularTop10(mlflow.pyfunc.PythonModel):
     def predict(self, context, model_input):
         return [self.anime[self.anime["anime_id"].isin(self.top10_ids)]["name"].tolist()]
 
-# === Step 5: Log + 註冊到 Registry ===
-with mlflow.start_run(run_name="popular-top10-cron") as run:
-    # Log params
-    mlflow.log_param("model_type", "PopularTop10")
-    mlflow.log_param("random_seed", random_seed)
-
-    # Log artifact (Top10 JSON)
-    result = {"random_seed": random_seed, "top10": top10_names}
-    with open("top10.json", "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    mlflow.log_artifact("top10.json")
-
-    # 註冊模型
-    result = mlflow.pyfunc.log_model(
-        artifact_path="model",
-        python_model=PopularTop10(anime, top10_ids),
-        registered_model_name="AnimeRecsysModel"
-    )
-    run_id = run.info.run_id
-
-# === Step 6: Transition to Staging ===
-latest_versions = client.get_latest_versions("AnimeRecsysModel", stages=["None"])
-if latest_versions:
-    new_version = max([int(v.version) for v in latest_versions])
-    client.transition_model_version_stage(
-        name="AnimeRecsysModel",
-        version=new_version,
-        stage="Staging",
-        archive_existing_versions=False
-    )
-    print(f"✅ AnimeRecsysModel v{new_version} 已自動設為 Staging")
\ No newline at end of file
+
+def main():
+    state = load_state()
+    previous = state[0] if state else {}
+
+    # === Step 0: 檢查輸入是否有變化 ===
+    with stage("scan_ratings"):
+        anime_hash = file_sha256(ANIME_PATH)
+        agg, scan, full_rebuild = scan_ratings(state)
+    input_hash = hashlib.sha256(f"{anime_hash}:{scan['ratings_hash']}".encode()).hexdigest()
+    print(f"📥 {'全量重算' if full_rebuild else '增量更新'}：新增 {scan['new_bytes']} bytes 評分資料")
+
+    if input_hash == previous.get("input_hash"):
+        save_state({**previous, **scan}, agg)
+        print("⏭️ 輸入資料未變動，略過本次 retrain")
+        return
+
+    with stage("select_top10"):
+        anime = load_anime(categorical=False)
+
+        # === Step 1: 由累積的 sum / count 計算平均分數 ===
+        stats = (agg["sum"] / agg["count"]).rename("rating").reset_index()
+        stats = stats.merge(anime[["anime_id", "name"]], on="anime_id")
+
+        # === Step 2: 熱門前 7 ===
+        top7 = stats.sort_values("rating", ascending=False).head(7)
+
+        # === Step 3: 隨機選 3 部（種子由輸入雜湊決定，相同資料 → 相同結果） ===
+        random_seed = int(input_hash[:8], 16) % 100000
+        random3 = stats.sample(3, random_state=random_seed)
+
+        # === Step 4: 組合 Top10 ===
+        top10 = pd.concat([top7, random3]).drop_duplicates("anime_id").head(10)
+        top10_ids = top10["anime_id"].tolist()
+        top10_names = top10["name"].tolist()
+        output_hash = hashlib.sha256(json.dumps([top10_ids, top10_names], ensure_ascii=False).encode()).hexdigest()
+    print(f"Random Seed: {random_seed}")
+    print("Top 10 Anime:", top10_names)
+
+    new_state = {**previous, **scan, "input_hash": input_hash}
+    if output_hash == previous.get("output_hash"):
+        save_state(new_state, agg)
+        print("⏭️ Top10 與上一版相同，不重複註冊模型")
+        return
+
+    # === Step 5: Log + 註冊到 Registry ===
+    with start_run(run_name="popular-top10-cron") as tracker:
+        # Log params（批次送出）
+        tracker.log_params({
+            "model_type": "PopularTop10",
+            "random_seed": random_seed,
+            "incremental": not full_rebuild,
+            "input_hash": input_hash[:12],
+        })
+        tracker.log_metric("new_rating_bytes", scan["new_bytes"])
+
+        # Log artifact (Top10 JSON，背景上傳)
+        tracker.log_dict({"random_seed": random_seed, "top10": top10_names}, "top10.json")
+
+        # 註冊模型
+        with stage("log_model"):
+            result = mlflow.pyfunc.log_model(
+                artifact_path="model",
+                python_model=PopularTop10(anime, top10_ids),
+                registered_model_name="AnimeRecsysModel"
+            )
+        log_instrumentation(tracker)  # 各 stage 的時間 / 記憶體
+        run_id = tracker.run_id
+
+    # === Step 6: Transition to Staging ===
+    latest_versions = client.get_latest_versions("AnimeRecsysModel", stages=["None"])
+    if latest_versions:
+        new_version = max([int(v.version) for v in latest_versions])
+        client.transition_model_version_stage(
+            name="AnimeRecsysModel",
+            version=new_version,
+            stage="Staging",
+            archive_existing_versions=False
+        )
+        new_state["model_version"] = new_version
+        print(f"✅ AnimeRecsysModel v{new_version} 已自動設為 Staging")
+
+    # 註冊成功後才寫入狀態，失敗時下次會重新嘗試
+    new_state.update({"output_hash": output_hash, "run_id": run_id})
+    save_state(new_state, agg)
+
+
+if __name__ == "__main__":
+    main()
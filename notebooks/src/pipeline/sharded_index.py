@@ -0,0 +1,241 @@
+"""分片檢索：物品矩陣依列切成 N 個 shard，查詢同時送到每個 shard，各自回傳 local top-K 後由 coordinator 合併
+
+- ProcessShard：每個 shard 由獨立的 worker 行程持有並計分，查詢延遲隨 CPU 核心數下降
+- LocalShard：在本行程的 thread pool 中計分；也是「遠端節點」的替身——
+  任何物件只要提供 submit(q_vec, k) → concurrent.futures.Future（回傳全域列索引與分數）就能當作 shard
+- 每次查詢有整體 timeout：逾時或出錯的 shard 直接略過，回傳其餘 shard 的合併結果（並記錄在 stats）
+
+用法：
+    index = ShardedIndex.build(tfidf_matrix, n_shards=4, mode="process", timeout=0.2)
+    idx, scores, missing = index.topk(q_vec, k=10)   # missing = 這次沒有回應的 shard 編號
+
+Benchmark：python -m src.pipeline.sharded_index --rows 200000 --shards 1 2 4
+"""
+import os
+import time
+import weakref
+import argparse
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.pipeline.ann_index import exact_topk
+
+DEFAULT_TIMEOUT = 0.2  # 秒
+STARTUP_TIMEOUT = 120  # worker 行程啟動（import + 接收 shard 矩陣）的等待上限
+
+
+def shard_ranges(n_rows, n_shards):
+    """連續列範圍 [(start, stop), ...]，各 shard 列數相差不超過 1"""
+    bounds = np.linspace(0, n_rows, n_shards + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _slice_rows(matrix, start, stop):
+    """CSR / QuantizedRows / PackedCSR 都支援以列索引陣列取子矩陣"""
+    return matrix[np.arange(start, stop)]
+
+
+class LocalShard:
+    _pool = None
+
+    def __init__(self, matrix, offset):
+        self.matrix = matrix
+        self.offset = offset
+        if LocalShard._pool is None:
+            LocalShard._pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="shard")
+
+    def _topk(self, q_vec, k):
+        idx, scores = exact_topk(self.matrix, q_vec, k)
+        return idx + self.offset, scores
+
+    def submit(self, q_vec, k):
+        return LocalShard._pool.submit(self._topk, q_vec, k)
+
+    def close(self):
+        pass
+
+
+def _serve_shard(conn, matrix, offset):
+    """worker 行程主迴圈：收到 (id, q_vec, k) 回傳 (id, 全域索引, 分數, 錯誤)"""
+    conn.send("ready")
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        query_id, q_vec, k = message
+        try:
+            idx, scores = exact_topk(matrix, q_vec, k)
+            conn.send((query_id, idx + offset, scores, None))
+        except Exception as e:
+            conn.send((query_id, None, None, repr(e)))
+
+
+class ProcessShard:
+    def __init__(self, matrix, offset, context=None):
+        context = context or mp.get_context("spawn")  # 在多執行緒的 serving 行程中 fork 不安全
+        self._conn, child = context.Pipe()
+        self.process = context.Process(target=_serve_shard, args=(child, matrix, offset), daemon=True)
+        self.process.start()
+        child.close()
+        self.offset = offset
+        # 等 worker 載入完成再開始接查詢，避免第一批請求全部逾時
+        if not self._conn.poll(STARTUP_TIMEOUT) or self._conn.recv() != "ready":
+            self.process.terminate()
+            raise RuntimeError(f"shard@{offset} worker did not start within {STARTUP_TIMEOUT}s")
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name=f"shard-reader-{offset}", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                query_id, idx, scores, error = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop(query_id, None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result((idx, scores))
+            else:
+                future.set_exception(RuntimeError(f"shard@{self.offset}: {error}"))
+        # worker 結束：尚在等待的查詢全部以錯誤結束
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"shard@{self.offset} worker exited"))
+
+    def submit(self, q_vec, k):
+        future = Future()
+        query_id = next(self._ids)
+        with self._lock:
+            if not self._reader.is_alive():
+                future.set_exception(RuntimeError(f"shard@{self.offset} worker is not running"))
+                return future
+            self._pending[query_id] = future
+            self._conn.send((query_id, q_vec, k))
+        return future
+
+    def close(self):
+        try:
+            self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._conn.close()
+
+
+class ShardedIndex:
+    def __init__(self, shards, timeout=DEFAULT_TIMEOUT):
+        self.shards = shards
+        self.timeout = timeout
+        self.queries = 0
+        self.partial = 0
+        self.timeouts = [0] * len(shards)
+        self.errors = [0] * len(shards)
+        self._finalizer = weakref.finalize(self, ShardedIndex._close_all, list(shards))
+
+    @classmethod
+    def build(cls, matrix, n_shards, mode="process", timeout=DEFAULT_TIMEOUT):
+        shard_cls = ProcessShard if mode == "process" else LocalShard
+        shards = [shard_cls(_slice_rows(matrix, a, b), a) for a, b in shard_ranges(matrix.shape[0], n_shards)]
+        print(f"🧱 建立 {len(shards)} 個 {mode} shard（{matrix.shape[0]} 列）")
+        return cls(shards, timeout)
+
+    def topk(self, q_vec, k=10, timeout=None):
+        """scatter-gather：回傳 (全域索引, 分數, 沒有回應的 shard 編號)"""
+        timeout = self.timeout if timeout is None else timeout
+        futures = [shard.submit(q_vec, k) for shard in self.shards]
+        wait(futures, timeout=timeout)
+
+        idx, scores, missing = [], [], []
+        for i, future in enumerate(futures):
+            if not future.done():
+                self.timeouts[i] += 1
+                missing.append(i)
+            elif future.exception() is not None:
+                self.errors[i] += 1
+                missing.append(i)
+            else:
+                shard_idx, shard_scores = future.result()
+                idx.append(shard_idx)
+                scores.append(shard_scores)
+        self.queries += 1
+        if missing:
+            self.partial += 1
+        if not idx:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), missing
+
+        idx, scores = np.concatenate(idx), np.concatenate(scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return idx[top], scores[top], missing
+
+    def stats(self):
+        return {
+            "shards": len(self.shards),
+            "queries": self.queries,
+            "partial": self.partial,
+            "timeouts": list(self.timeouts),
+            "errors": list(self.errors),
+        }
+
+    @staticmethod
+    def _close_all(shards):
+        for shard in shards:
+            shard.close()
+
+    def close(self):
+        self._finalizer()
+
+
+# === Benchmark ===
+def _benchmark(n_rows, n_terms, shard_counts, mode, queries, k, seed=42):
+    rng = np.random.default_rng(seed)
+    # 每列 8 個非零詞，L2 normalize 後與 TF-IDF 相同尺度
+    indices = rng.integers(0, n_terms, size=n_rows * 8).astype(np.int32)
+    data = rng.random(n_rows * 8, dtype=np.float32)
+    matrix = sp.csr_matrix((data, indices, np.arange(0, n_rows * 8 + 1, 8)), shape=(n_rows, n_terms))
+    matrix.sum_duplicates()
+    matrix = sp.diags(1 / np.sqrt(matrix.multiply(matrix).sum(axis=1).A1)).astype(np.float32) @ matrix
+    q_rows = rng.choice(n_rows, queries, replace=False)
+    baseline = [exact_topk(matrix, matrix[r], k)[0] for r in q_rows]
+
+    for n_shards in shard_counts:
+        index = ShardedIndex.build(matrix, n_shards, mode, timeout=10)
+        index.topk(matrix[q_rows[0]], k)  # 暖機（worker 行程啟動、import）
+        latencies, recall = [], []
+        for r, expected in zip(q_rows, baseline):
+            start = time.perf_counter()
+            idx, _, _ = index.topk(matrix[r], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recall.append(len(set(idx) & set(expected)) / len(expected))
+        print(f"  ⏱️ {n_shards} shard(s)：p50 {np.percentile(latencies, 50):.2f} ms、"
+              f"p95 {np.percentile(latencies, 95):.2f} ms、recall {np.mean(recall):.3f}")
+        index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分片檢索的延遲 benchmark（隨機稀疏矩陣）")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--terms", type=int, default=3000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--mode", choices=["process", "local"], default="process")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    _benchmark(args.rows, args.terms, args.shards, args.mode, args.queries, args.k)
@@ -0,0 +1,198 @@
+"""TF-IDF 超參數 sweep：以 process pool 平行執行 Optuna trials
+
+- 目錄只在主程序載入一次，以 fork 讓 worker 共用（copy-on-write，唯讀）
+- 每個 trial 只計算評估樣本那幾列的相似度，不建立完整 N×N 相似度矩陣
+- Precision@10 分批評估並回報給 MedianPruner，表現差的 trial 提早停止
+- 全部 trial 結束後以 log_batch 批次寫入 MLflow（一個 parent run + 每個 trial 一個 child run）
+
+用法：python -m src.pipeline.sweep --pipeline v3 --n-trials 64 --workers 8
+"""
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import optuna
+import mlflow
+from mlflow.entities import Metric, Param
+from mlflow.tracking import MlflowClient
+from optuna.storages import JournalStorage, JournalFileStorage
+
+from src.pipeline.pipeline_v3 import AnimePipelineV3
+from src.pipeline.pipeline_v4 import AnimePipelineV4
+from src.pipeline.feature_store import default_store
+from src.pipeline.tracking import start_run, tracking_uri
+
+PIPELINES = {"v3": AnimePipelineV3, "v4": AnimePipelineV4}
+# Optuna storage 只接受基本型別，ngram_range 以字串表示
+NGRAM_CHOICES = {"1-1": (1, 1), "1-2": (1, 2)}
+STUDY_NAME = "tfidf-sweep"
+
+# worker 共用的唯讀目錄；fork 前由主程序設定，spawn 時由 initializer 載入
+_CATALOG = None
+
+
+def load_catalog(pipeline="v3", sample_size=None, n_eval=500, n_steps=5, seed=42):
+    """載入目錄並預先算好兩種特徵文字、genre 編碼與固定的評估樣本"""
+    pipe = PIPELINES[pipeline](sample_size=sample_size)
+    data = pipe.load_data()
+    anime = data[0] if isinstance(data, tuple) else data
+
+    genre_codes = anime["genre"].astype("category").cat.codes.to_numpy()
+    counts = np.bincount(genre_codes[genre_codes >= 0], minlength=1)
+    # 與 evaluate_and_log 相同：同 genre 至少還有其他作品才列入評估
+    valid = (genre_codes >= 0) & (counts[np.maximum(genre_codes, 0)] > 1)
+
+    rng = np.random.default_rng(seed)
+    eval_idx = rng.choice(len(anime), min(n_eval, len(anime)), replace=False)
+    return {
+        "pipeline": pipe,
+        "features": {use_type: pipe.build_features(anime, use_type) for use_type in (True, False)},
+        "genre_codes": genre_codes,
+        "eval_batches": np.array_split(eval_idx[valid[eval_idx]], n_steps),
+    }
+
+
+def precision_at_k_batch(tfidf, rows, genre_codes, k=10):
+    """一次計算多個查詢的 Precision@k（TF-IDF 已 L2 normalize，內積即 cosine）"""
+    sims = (tfidf[rows] @ tfidf.T).toarray()
+    sims[np.arange(len(rows)), rows] = -np.inf  # 排除自己
+    k = min(k, sims.shape[1] - 1)
+    top = np.argpartition(-sims, k, axis=1)[:, :k]
+    hits = (genre_codes[top] == genre_codes[rows][:, None]).sum(axis=1)
+    return hits / k
+
+
+def objective(trial):
+    catalog = _CATALOG
+    params = {
+        "max_features": trial.suggest_int("max_features", 500, 3000, step=250),
+        "ngram_range": NGRAM_CHOICES[trial.suggest_categorical("ngram_range", list(NGRAM_CHOICES))],
+        "min_df": trial.suggest_int("min_df", 1, 5),
+    }
+    use_type = trial.suggest_categorical("use_type", [True, False])
+
+    recipe = "genre+type" if use_type else "genre"
+    tfidf, _ = catalog["pipeline"].fit_tfidf(catalog["features"][use_type], recipe=recipe, **params)
+    tfidf = tfidf.tocsr()
+    trial.set_user_attr("feature_cache_hit", bool(default_store().last_hit))
+
+    scores = []
+    for step, rows in enumerate(catalog["eval_batches"]):
+        if len(rows):
+            scores.extend(precision_at_k_batch(tfidf, rows, catalog["genre_codes"]))
+        value = float(np.mean(scores)) if scores else 0.0
+        trial.report(value, step)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+    return value
+
+
+def _init_worker(catalog_kwargs):
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = load_catalog(**catalog_kwargs)
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+
+def _run_worker(journal_path, n_trials, seed):
+    """每個 worker 透過共用的 journal storage 領取 trial，直到總數達到 n_trials"""
+    study = optuna.load_study(
+        study_name=STUDY_NAME,
+        storage=JournalStorage(JournalFileStorage(journal_path)),
+        sampler=optuna.samplers.TPESampler(seed=seed),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=4, n_warmup_steps=1),
+    )
+    study.optimize(
+        objective,
+        n_trials=n_trials,
+        callbacks=[optuna.study.MaxTrialsCallback(n_trials, states=None)],
+        catch=(ValueError,),  # 例如 min_df 過高導致沒有任何詞彙
+    )
+
+
+def _log_trial(client, parent, trial):
+    """每個 trial 一個 child run：create + 一次 log_batch + terminate"""
+    now = int(time.time() * 1000)
+    run = client.create_run(
+        parent.info.experiment_id,
+        run_name=f"trial-{trial.number}",
+        tags={"mlflow.parentRunId": parent.info.run_id, "trial_state": trial.state.name},
+    )
+    metrics = [Metric("precision_at_10_partial", v, now, step) for step, v in trial.intermediate_values.items()]
+    if trial.value is not None:
+        metrics.append(Metric("precision_at_10", trial.value, now, 0))
+    if trial.duration is not None:
+        metrics.append(Metric("trial_seconds", trial.duration.total_seconds(), now, 0))
+    client.log_batch(run.info.run_id, metrics=metrics, params=[Param(k, str(v)) for k, v in trial.params.items()])
+    client.set_terminated(run.info.run_id, "FAILED" if trial.state == optuna.trial.TrialState.FAIL else "FINISHED")
+
+
+def log_study(study, sweep_params, run_name="tfidf-sweep", log_workers=8):
+    """把所有 trial 批次寫入 MLflow；各 trial 的 child run 以 thread pool 平行上傳"""
+    client = MlflowClient()
+    completed = [t for t in study.trials if t.state == optuna.trial.TrialState.COMPLETE]
+
+    with start_run(run_name=run_name) as tracker:
+        tracker.log_params(sweep_params)
+        tracker.log_metrics({
+            "n_trials": len(study.trials),
+            "n_pruned": sum(t.state == optuna.trial.TrialState.PRUNED for t in study.trials),
+            "feature_cache_hits": sum(bool(t.user_attrs.get("feature_cache_hit")) for t in study.trials),
+        })
+        if completed:
+            tracker.log_metric("best_precision_at_10", study.best_value)
+            tracker.log_params({f"best_{k}": v for k, v in study.best_params.items()})
+
+        with ThreadPoolExecutor(max_workers=log_workers, thread_name_prefix="mlflow-trial") as pool:
+            futures = [pool.submit(_log_trial, client, tracker.run, t) for t in study.trials]
+            for future in futures:
+                future.result()
+
+        print("Run ID:", tracker.run_id)
+
+
+def run_sweep(pipeline="v3", sample_size=None, n_trials=32, workers=None, n_eval=500, n_steps=5, seed=42):
+    global _CATALOG
+    workers = workers or os.cpu_count()
+    catalog_kwargs = {"pipeline": pipeline, "sample_size": sample_size, "n_eval": n_eval, "n_steps": n_steps, "seed": seed}
+
+    # 在建立 process pool 前載入，fork 後 worker 直接共用這份記憶體
+    _CATALOG = load_catalog(**catalog_kwargs)
+
+    journal_path = os.path.join(tempfile.mkdtemp(prefix="tfidf-sweep-"), "journal.log")
+    storage = JournalStorage(JournalFileStorage(journal_path))
+    optuna.create_study(study_name=STUDY_NAME, storage=storage, direction="maximize")
+
+    start = time.time()
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(catalog_kwargs,)) as pool:
+        futures = [pool.submit(_run_worker, journal_path, n_trials, seed + i) for i in range(workers)]
+        for future in futures:
+            future.result()
+    elapsed = time.time() - start
+
+    study = optuna.load_study(study_name=STUDY_NAME, storage=storage)
+    log_study(study, {**catalog_kwargs, "n_trials": n_trials, "workers": workers, "sweep_seconds": round(elapsed, 2)})
+    return study
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="平行 TF-IDF 超參數 sweep")
+    parser.add_argument("--pipeline", choices=list(PIPELINES), default="v3")
+    parser.add_argument("--sample-size", type=int, default=None, help="預設使用完整目錄")
+    parser.add_argument("--n-trials", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None, help="預設為 CPU 核心數")
+    parser.add_argument("--n-eval", type=int, default=500, help="評估用的動畫數量")
+    parser.add_argument("--experiment", default="anime-recsys-sweep")
+    args = parser.parse_args()
+
+    mlflow.set_tracking_uri(tracking_uri())
+    mlflow.set_experiment(args.experiment)
+
+    study = run_sweep(args.pipeline, args.sample_size, args.n_trials, args.workers, args.n_eval)
+    print("最佳參數:", study.best_params)
+    print(f"Precision@10 = {study.best_value:.4f}")
@@ -0,0 +1,219 @@
+"""AnimeRecsysTFIDF 的 pyfunc 模型與註冊用的 artifact 建置
+
+TFIDFRecommender 原本定義在 day25 notebook；移到這裡後，註冊時以 code_paths=["src"] 一併打包，
+serving 端（FastAPI）不需要安裝本專案也能載入。
+
+model_config（可在 load_model 時覆寫）：
+    ann          是否使用 LSH 近似最近鄰（預設 True，artifact 中有 ann_index 時才生效）
+    ann_probes   0 = 只查同一個 bucket；1 = 另外探測 1-bit 鄰近 bucket（recall ↑、latency ↑）
+    top_k        推薦數量，預設 10
+    shards       > 1 時把矩陣切成多個 shard 平行計分（src/pipeline/sharded_index.py），取代 ANN；預設 0 = 關閉
+    shard_mode   "process"（每個 shard 一個 worker 行程）或 "local"（本行程 thread）
+    shard_timeout_ms  單次查詢等待 shard 的上限；逾時的 shard 略過，全部逾時則改在本行程暴力搜尋
+
+artifact 中有 explanations 時，explain(anime_id) 以查表回傳該作品貢獻最大的 TF-IDF 詞（FastAPI /explain 使用）。
+
+目錄增量（src/pipeline/catalog_delta.py）以 apply_delta() 原地套用：新作品放在獨立的 delta 區段精確計分、
+被更新或下架的原有列只標記為 retired，不需要重建 TF-IDF 矩陣與 ANN 索引。
+"""
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import mlflow.pyfunc
+
+from src.pipeline.ann_index import RandomProjectionLSH, exact_topk
+from src.pipeline.catalog_delta import load_delta
+from src.pipeline.explain import ItemExplanations, build_explanations, top_terms
+from src.pipeline.precision import DEFAULT_PRECISION, quantize, save_rows, load_rows, row_scores
+from src.pipeline.sharded_index import ShardedIndex
+
+DEFAULT_ANN_PARAMS = {"n_tables": 8, "n_bits": 12}
+DEFAULT_MODEL_CONFIG = {"ann": True, "ann_probes": 1, "top_k": 10, "shards": 0, "shard_mode": "process",
+                        "shard_timeout_ms": 200}
+
+
+def build_artifacts(anime, vectorizer, tfidf_matrix, artifact_dir, ann_params=DEFAULT_ANN_PARAMS,
+                    precision=DEFAULT_PRECISION):
+    """把註冊所需的檔案寫到 artifact_dir，回傳 log_model 用的 artifacts dict
+
+    precision 決定 TF-IDF 矩陣的儲存精度（float64 / float32 / float16 / int8），serving 端原樣載入
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    artifacts = {
+        "anime": os.path.join(artifact_dir, "anime.csv"),
+        "vectorizer": os.path.join(artifact_dir, "vectorizer.pkl"),
+        "tfidf_matrix": os.path.join(artifact_dir, "tfidf_matrix.npz"),
+    }
+    anime.to_csv(artifacts["anime"], index=False)
+    with open(artifacts["vectorizer"], "wb") as f:
+        pickle.dump(vectorizer, f)
+    save_rows(artifacts["tfidf_matrix"], quantize(sp.csr_matrix(tfidf_matrix), precision))
+
+    if ann_params:
+        artifacts["ann_index"] = os.path.join(artifact_dir, "ann_index.npz")
+        RandomProjectionLSH(**ann_params).fit(tfidf_matrix).save(artifacts["ann_index"])
+
+    # 整個目錄的「為什麼推薦」事先算好，serving 端只查表
+    artifacts["explanations"] = os.path.join(artifact_dir, "item_explanations.npz")
+    build_explanations(
+        anime["anime_id"], tfidf_matrix, vectorizer.get_feature_names_out()
+    ).save(artifacts["explanations"])
+    return artifacts
+
+
+class TFIDFRecommender(mlflow.pyfunc.PythonModel):
+    def load_context(self, context):
+        self.config = {**DEFAULT_MODEL_CONFIG, **(getattr(context, "model_config", None) or {})}
+
+        self.anime = pd.read_csv(context.artifacts["anime"])
+        # 直接載入註冊時 fit 好的 vectorizer 與矩陣，serving 端不必重新 fit
+        with open(context.artifacts["vectorizer"], "rb") as f:
+            self.vectorizer = pickle.load(f)
+        self.tfidf_matrix = load_rows(context.artifacts["tfidf_matrix"])
+        self.anime_titles = self.anime["name"].fillna("").tolist()
+
+        self.ann_index = None
+        if self.config["ann"] and "ann_index" in context.artifacts:
+            self.ann_index = RandomProjectionLSH.load(context.artifacts["ann_index"])
+
+        self.sharded = None
+        if self.config["shards"] > 1:
+            self.sharded = ShardedIndex.build(
+                self.tfidf_matrix, self.config["shards"], self.config["shard_mode"],
+                timeout=self.config["shard_timeout_ms"] / 1000,
+            )
+
+        self.explanations = None
+        if "explanations" in context.artifacts:
+            self.explanations = ItemExplanations.load(context.artifacts["explanations"])
+
+        # 目錄增量：None 表示尚未套用任何 delta（整個狀態一次替換，推論中的請求看到的永遠是一致的版本）
+        self._delta = None
+        self._delta_lock = threading.Lock()
+        self.applied_deltas = []
+
+    def recommend(self, titles, top_k=None):
+        """回傳 (推薦索引, 分數)；有 ANN 索引時先取候選再精確 rerank"""
+        top_k = top_k or self.config["top_k"]
+        q_vec = self.vectorizer.transform([" ".join(titles)])
+        delta = self._delta
+        # 多取被 retired 的數量，過濾後仍有 top_k 筆
+        base_k = top_k + (delta["n_retired_base"] if delta else 0)
+        idx = None
+        if self.sharded is not None:
+            # 部分 shard 逾時仍回傳其餘結果；全部沒有回應才退回本行程計分
+            idx, scores, missing = self.sharded.topk(q_vec, base_k)
+            if len(missing) == len(self.sharded.shards):
+                idx = None
+        if idx is None:
+            rows = None
+            if self.ann_index is not None:
+                # 候選不足 top_k 時回傳 None → 改走暴力搜尋，確保結果數量
+                rows = self.ann_index.candidates(q_vec, probes=self.config["ann_probes"], min_candidates=base_k)
+            idx, scores = exact_topk(self.tfidf_matrix, q_vec, base_k, rows)
+        if delta is None:
+            return idx, scores
+
+        # delta 區段很小，直接全部精確計分後與原矩陣的結果合併
+        delta_idx = np.arange(delta["matrix"].shape[0]) + self.tfidf_matrix.shape[0]
+        idx = np.concatenate([idx, delta_idx])
+        scores = np.concatenate([scores, row_scores(delta["matrix"], q_vec)])
+        keep = ~delta["retired"][idx]
+        idx, scores = idx[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return idx[order], scores[order]
+
+    def active_rows(self, idx):
+        """去掉已被 delta 更新或下架的列（預先算好的結果，例如 UserTopK 的推薦表，需要過濾）"""
+        delta = self._delta
+        return idx if delta is None else idx[~delta["retired"][idx]]
+
+    def apply_delta(self, path, name=None):
+        """原地套用一個目錄 delta；同名 delta 只套用一次，回傳是否有套用"""
+        name = name or os.path.basename(path)
+        with self._delta_lock:
+            if name in self.applied_deltas:
+                return False
+            update = load_delta(path)
+            n_base, n_terms = self.tfidf_matrix.shape
+            if update["matrix"].shape[1] != n_terms:
+                raise ValueError(f"delta {name} 的詞彙數 {update['matrix'].shape[1]} 與模型 ({n_terms}) 不符")
+
+            delta = self._delta or {
+                "matrix": sp.csr_matrix((0, n_terms), dtype=np.float32),
+                "retired": np.zeros(n_base, dtype=bool),
+                "rows": {int(a): i for i, a in enumerate(self.anime["anime_id"])},
+                "terms": {},
+            }
+            start = n_base + delta["matrix"].shape[0]
+            ids = update["anime"]["anime_id"].astype(int).tolist()
+            retired = np.concatenate([delta["retired"], np.zeros(len(ids), dtype=bool)])
+            rows, terms = dict(delta["rows"]), dict(delta["terms"])
+            for anime_id in [*update["removed"].tolist(), *ids]:
+                row = rows.pop(int(anime_id), None)
+                if row is not None:
+                    retired[row] = True
+                    terms.pop(row, None)
+            for i, anime_id in enumerate(ids):
+                rows[anime_id] = start + i
+
+            # 新列的「為什麼推薦」也一併算好
+            term_idx, weights = top_terms(update["matrix"])
+            names = self.vectorizer.get_feature_names_out()
+            for i in range(len(ids)):
+                keep = term_idx[i] >= 0
+                terms[start + i] = [
+                    {"term": str(names[t]), "weight": round(float(w), 4)}
+                    for t, w in zip(term_idx[i][keep], weights[i][keep])
+                ]
+
+            self.anime = pd.concat([self.anime, update["anime"]], ignore_index=True)
+            self.anime_titles = self.anime_titles + update["anime"]["name"].fillna("").astype(str).tolist()
+            self._delta = {
+                "matrix": sp.vstack([delta["matrix"], update["matrix"].astype(np.float32)]).tocsr(),
+                "retired": retired,
+                "n_retired_base": int(retired[:n_base].sum()),
+                "rows": rows,
+                "terms": terms,
+            }
+            self.applied_deltas.append(name)
+        print(f"🧩 套用目錄 delta {name}：+{len(ids)} 筆、下架 {len(update['removed'])} 筆")
+        return True
+
+    def catalog(self):
+        """目前生效的作品清單（已套用 delta），compact 時用來重建模型"""
+        delta = self._delta
+        anime = self.anime if delta is None else self.anime[~delta["retired"]]
+        return anime.reset_index(drop=True)
+
+    def explain(self, anime_id, top_n=None):
+        """回傳 {"anime_id", "name", "top_terms"}；作品不存在或模型沒有解釋 artifact 時回傳 None"""
+        delta = self._delta
+        if delta is not None:
+            try:
+                row = delta["rows"].get(int(anime_id))
+            except (TypeError, ValueError):
+                return None
+            if row is None:
+                return None
+            if row in delta["terms"]:
+                return {"anime_id": int(anime_id), "name": self.anime_titles[row],
+                        "top_terms": delta["terms"][row][:top_n]}
+        if self.explanations is None:
+            return None
+        row = self.explanations.row_of(anime_id)
+        if row is None:
+            return None
+        return {
+            "anime_id": int(anime_id),
+            "name": self.anime_titles[row],
+            "top_terms": self.explanations.explain(anime_id, top_n),
+        }
+
+    def predict(self, context, model_input):
+        top_idx, _ = self.recommend(model_input[0].tolist())
+        recommendations = [self.anime_titles[i] for i in top_idx]
+        return [recommendations]
@@ -0,0 +1,156 @@
+"""批次化、非阻塞的 MLflow tracking facade
+
+原本每個 log_param / log_metric / log_artifact 都是一次同步 HTTP 請求；這裡改成：
+- params / metrics / tags 先暫存，flush 時以 log_batch 一次送出（背景執行緒）
+- artifact 在背景執行緒上傳，log_dict 寫到暫存資料夾而不是工作目錄
+- run 結束前自動 flush 並等待所有上傳完成
+
+用法：
+    from src.pipeline.tracking import start_run
+    with start_run(run_name="pipeline-v3") as tracker:
+        tracker.log_params(params)
+        tracker.log_metric("precision_at_10", 0.42)
+        tracker.log_dict(examples, "recommendations.json")
+
+測試時可改用本機 file store：use_local_store() 或設定 MLFLOW_TRACKING_URI=file:///tmp/mlruns
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mlflow
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+
+DEFAULT_TRACKING_URI = "http://mlflow:5000"
+
+# MLflow log_batch 單次上限
+MAX_PARAMS_PER_BATCH = 100
+MAX_ENTITIES_PER_BATCH = 1000
+
+
+def tracking_uri():
+    """與 notebooks 相同：優先使用 MLFLOW_TRACKING_URI，否則連到 docker-compose 內的 server"""
+    return os.getenv("MLFLOW_TRACKING_URI", DEFAULT_TRACKING_URI)
+
+
+def use_local_store(path=None):
+    """把 tracking 指到本機 file store（測試用，不需要 MLflow server），回傳 URI"""
+    path = path or tempfile.mkdtemp(prefix="mlruns-")
+    uri = Path(path).absolute().as_uri()
+    mlflow.set_tracking_uri(uri)
+    return uri
+
+
+class BatchedTracker:
+    def __init__(self, run_id, client=None, executor=None):
+        self.run_id = run_id
+        self.run = None  # 由 start_run() 設定
+        self.client = client or MlflowClient()
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=2, thread_name_prefix="mlflow-upload")
+        self._lock = threading.Lock()
+        self._params = {}
+        self._metrics = []
+        self._tags = {}
+        self._futures = []
+        self._tmpdir = None
+
+    # === params / metrics / tags：先暫存 ===
+    def log_param(self, key, value):
+        with self._lock:
+            self._params[key] = str(value)
+
+    def log_params(self, params):
+        with self._lock:
+            self._params.update({k: str(v) for k, v in params.items()})
+
+    def log_metric(self, key, value, step=0):
+        with self._lock:
+            self._metrics.append(Metric(key, float(value), int(time.time() * 1000), step))
+            full = len(self._metrics) >= MAX_ENTITIES_PER_BATCH
+        if full:
+            self.flush()
+
+    def log_metrics(self, metrics, step=0):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step)
+
+    def set_tag(self, key, value):
+        with self._lock:
+            self._tags[key] = str(value)
+
+    def flush(self):
+        """把目前暫存的內容切成數個 log_batch，交給背景執行緒送出"""
+        with self._lock:
+            params = [Param(k, v) for k, v in self._params.items()]
+            metrics, tags = self._metrics, [RunTag(k, v) for k, v in self._tags.items()]
+            self._params, self._metrics, self._tags = {}, [], {}
+
+        while params or metrics or tags:
+            batch_params, params = params[:MAX_PARAMS_PER_BATCH], params[MAX_PARAMS_PER_BATCH:]
+            room = MAX_ENTITIES_PER_BATCH - len(batch_params)
+            batch_tags, tags = tags[:room], tags[room:]
+            room -= len(batch_tags)
+            batch_metrics, metrics = metrics[:room], metrics[room:]
+            self._submit(self.client.log_batch, self.run_id, metrics=batch_metrics, params=batch_params, tags=batch_tags)
+
+    # === artifacts：背景上傳 ===
+    def log_artifact(self, local_path, artifact_path=None):
+        self._submit(self.client.log_artifact, self.run_id, local_path, artifact_path)
+
+    def log_dict(self, dictionary, artifact_file):
+        """寫到暫存資料夾後在背景上傳（不會在工作目錄留下檔案）"""
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="mlflow-artifacts-")
+        local_dir = tempfile.mkdtemp(dir=self._tmpdir)
+        local_path = os.path.join(local_dir, os.path.basename(artifact_file))
+        with open(local_path, "w", encoding="utf-8") as f:
+            json.dump(dictionary, f, ensure_ascii=False, indent=2)
+        self.log_artifact(local_path, os.path.dirname(artifact_file) or None)
+
+    def _submit(self, fn, *args, **kwargs):
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.append(future)
+
+    def wait(self):
+        """flush 後等待所有背景工作完成；任何一個失敗都會在這裡拋出"""
+        self.flush()
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self._own_executor:
+                self._executor.shutdown(wait=True)
+            if self._tmpdir:
+                shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+@contextmanager
+def start_run(run_name=None, nested=False, tags=None):
+    """mlflow.start_run 的包裝：yield BatchedTracker，結束 run 前自動 flush"""
+    with mlflow.start_run(run_name=run_name, nested=nested, tags=tags) as run:
+        tracker = BatchedTracker(run.info.run_id)
+        tracker.run = run
+        try:
+            yield tracker
+        except BaseException:
+            # 主體已失敗：flush / 上傳的錯誤只記錄，不蓋掉原本的例外
+            try:
+                tracker.close()
+            except Exception as e:
+                print(f"⚠️ run 結束前 flush 失敗：{e}")
+            raise
+        tracker.close()
@@ -0,0 +1,202 @@
+"""為每個已知使用者預先算好 Top-K 推薦，serving 時直接查表
+
+離線批次：
+- 使用者輪廓 = 喜歡的作品 (rating > LIKED_THRESHOLD) 的 TF-IDF 向量總和
+- 一次處理 BATCH_USERS 位使用者：輪廓 @ TF-IDF.T → 遮掉已評分作品 → argpartition 取 Top-K
+- 結果寫成 (n_users × K) 的 int32 表（作品列索引，-1 表示不足 K 筆），
+  另存 user_id → 列號 的 dense 索引（-1 表示不在表中）
+
+Serving（UserTopKRecommender）：
+- 兩個 .npy 以 mmap 開啟，已知使用者只是一次陣列查表
+- 未知使用者（或沒有喜歡作品的使用者）退回 TFIDFRecommender 的內容推薦
+
+用法：python -m src.pipeline.user_topk --top_k 10 --register
+"""
+import os
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import mlflow
+import mlflow.pyfunc
+from mlflow.tracking import MlflowClient
+
+from src.pipeline.data_store import load_anime, load_ratings, as_text
+from src.pipeline.feature_store import default_store, fit_tfidf_cached
+from src.pipeline.tfidf_model import TFIDFRecommender, build_artifacts, DEFAULT_MODEL_CONFIG
+from src.pipeline.precision import DEFAULT_PRECISION, PRECISIONS, load_rows, precision_of
+from src.pipeline.tracking import tracking_uri, start_run
+from src.pipeline.instrumentation import stage, log_instrumentation
+
+MODEL_NAME = "AnimeRecsysUserTopK"
+LIKED_THRESHOLD = 7  # 與 train_user_based.py 相同：rating > 7 視為喜歡
+BATCH_USERS = 1024
+
+
+def interaction_matrix(ratings, user_ids, anime_ids, min_rating=None):
+    """ratings → (n_users × n_items) CSR；min_rating 不為 None 時只保留 rating > min_rating"""
+    if min_rating is not None:
+        ratings = ratings[ratings["rating"].to_numpy() > min_rating]
+    rows = np.searchsorted(user_ids, ratings["user_id"].to_numpy())
+    cols = pd.Index(anime_ids).get_indexer(ratings["anime_id"].to_numpy())
+    known = cols >= 0
+    data = np.ones(known.sum(), dtype=np.float32)
+    matrix = sp.csr_matrix((data, (rows[known], cols[known])), shape=(len(user_ids), len(anime_ids)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def build_user_topk(tfidf_matrix, liked, seen, top_k=10, batch_users=BATCH_USERS):
+    """回傳 (n_users × top_k) int32 表；沒有喜歡作品的使用者整列為 -1"""
+    n_users, n_items = liked.shape
+    top_k = min(top_k, n_items)
+    table = np.full((n_users, top_k), -1, dtype=np.int32)
+    item_t = sp.csr_matrix(tfidf_matrix, dtype=np.float32).T.tocsr()
+
+    for start in range(0, n_users, batch_users):
+        stop = min(start + batch_users, n_users)
+        profiles = liked[start:stop] @ tfidf_matrix
+        scores = np.asarray((profiles @ item_t).todense(), dtype=np.float32)
+
+        # 遮掉已評分作品
+        seen_batch = seen[start:stop].tocoo()
+        scores[seen_batch.row, seen_batch.col] = -np.inf
+
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top[~np.isfinite(top_scores) | (top_scores <= 0)] = -1
+
+        has_profile = np.diff(liked.indptr[start:stop + 1]) > 0
+        table[start:stop][has_profile] = top[has_profile]
+    return table
+
+
+def user_offsets(user_ids, table):
+    """dense 索引：offsets[user_id] = 表中列號，沒有推薦的使用者為 -1"""
+    offsets = np.full(int(user_ids.max()) + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+    has_recs = table[:, 0] >= 0
+    offsets[user_ids[has_recs]] = np.nonzero(has_recs)[0].astype(np.int32)
+    return offsets
+
+
+def precision_at_k(table, offsets, ratings_test, anime_ids):
+    """以查表結果計算 precision@K（只計算測試集中有喜歡作品、且在表中的使用者）"""
+    liked = ratings_test[ratings_test["rating"].to_numpy() > LIKED_THRESHOLD]
+    uid = liked["user_id"].to_numpy()
+    in_range = uid < len(offsets)
+    uid = uid[in_range]
+    rows = offsets[uid]
+    cols = pd.Index(anime_ids).get_indexer(liked["anime_id"].to_numpy()[in_range])
+    keep = (rows >= 0) & (cols >= 0)
+    if not keep.any():
+        return 0.0, 0
+    hit = (table[rows[keep]] == cols[keep, None]).any(axis=1)
+    per_user = pd.Series(hit).groupby(uid[keep]).sum()
+    return float((per_user / table.shape[1]).mean()), len(per_user)
+
+
+class UserTopKRecommender(TFIDFRecommender):
+    """已知使用者查預先算好的表；其餘情況沿用 TF-IDF 內容推薦"""
+
+    def load_context(self, context):
+        super().load_context(context)
+        self.user_table = np.load(context.artifacts["user_topk"], mmap_mode="r")
+        self.user_offsets = np.load(context.artifacts["user_offsets"], mmap_mode="r")
+
+    def lookup(self, user_id):
+        """回傳作品列索引；使用者不在表中時回傳 None"""
+        try:
+            uid = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= uid < len(self.user_offsets) or self.user_offsets[uid] < 0:
+            return None
+        row = self.user_table[self.user_offsets[uid]]
+        return row[row >= 0]
+
+    def predict(self, context, model_input):
+        if "user_id" in model_input.columns:
+            top_idx = self.lookup(model_input["user_id"].iloc[0])
+            if top_idx is not None:
+                return [[self.anime_titles[i] for i in self.active_rows(top_idx)]]
+        return super().predict(context, model_input)
+
+
+def main(top_k=10, register=False, precision=DEFAULT_PRECISION):
+    with stage("load_data"):
+        anime = load_anime(categorical=False)
+        ratings_train = load_ratings("train")
+        ratings_test = load_ratings("test")
+
+    with stage("fit_tfidf"):
+        tfidf_matrix, vectorizer = fit_tfidf_cached(
+            as_text(anime["genre"]), recipe="genre", stop_words="english", max_features=3000
+        )
+    anime_ids = anime["anime_id"].to_numpy()
+    user_ids = np.unique(ratings_train["user_id"].to_numpy())
+
+    # === 批次計算全部使用者的 Top-K ===
+    with stage("interaction_matrix"):
+        liked = interaction_matrix(ratings_train, user_ids, anime_ids, min_rating=LIKED_THRESHOLD)
+        seen = interaction_matrix(ratings_train, user_ids, anime_ids)
+    with stage("build_user_topk"):
+        table = build_user_topk(tfidf_matrix, liked, seen, top_k)
+        offsets = user_offsets(user_ids, table)
+    with stage("evaluate"):
+        precision, n_eval = precision_at_k(table, offsets, ratings_test, anime_ids)
+    n_served = int((offsets >= 0).sum())
+    print(f"👥 {n_served}/{len(user_ids)} 位使用者有預先推薦，precision@{top_k} = {precision:.4f}（{n_eval} 位）")
+
+    if not register:
+        return table, offsets
+
+    # === 寫出 artifacts 並註冊 ===
+    mlflow.set_tracking_uri(tracking_uri())
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        artifacts = build_artifacts(anime, vectorizer, tfidf_matrix, artifact_dir, precision=precision)
+        stored_precision = precision_of(load_rows(artifacts["tfidf_matrix"]))  # 以實際寫出的 artifact 為準
+        artifacts["user_topk"] = os.path.join(artifact_dir, "user_topk.npy")
+        artifacts["user_offsets"] = os.path.join(artifact_dir, "user_offsets.npy")
+        np.save(artifacts["user_topk"], table)
+        np.save(artifacts["user_offsets"], offsets)
+
+        with start_run(run_name="user-topk-batch") as tracker:
+            tracker.log_params({
+                "model_type": "UserTopK", "top_k": top_k, "liked_threshold": LIKED_THRESHOLD, "precision": stored_precision,
+            })
+            tracker.log_metrics({
+                f"precision_at_{top_k}": precision,
+                "users_served": n_served,
+                "table_bytes": table.nbytes + offsets.nbytes,
+            })
+            default_store().log_stats()
+            log_instrumentation(tracker)  # 各 stage 的時間 / 記憶體
+            mlflow.pyfunc.log_model(
+                artifact_path="model",
+                python_model=UserTopKRecommender(),
+                artifacts=artifacts,
+                code_paths=[os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))],
+                model_config=DEFAULT_MODEL_CONFIG,
+                registered_model_name=MODEL_NAME,
+            )
+
+    # === 切換到 Staging（FastAPI 載入 Staging 版本） ===
+    client = MlflowClient()
+    latest = max(client.get_latest_versions(MODEL_NAME, stages=["None"]), key=lambda v: int(v.version))
+    client.transition_model_version_stage(MODEL_NAME, latest.version, stage="Staging")
+    print(f"✅ {MODEL_NAME} v{latest.version} 已設為 Staging")
+    return table, offsets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--register", action="store_true", help="寫出查表 artifact 並註冊到 Model Registry")
+    parser.add_argument("--precision", choices=PRECISIONS, default=DEFAULT_PRECISION, help="TF-IDF 矩陣的儲存精度")
+    args = parser.parse_args()
+    main(args.top_k, args.register, args.precision)
@@ -0,0 +1,238 @@
+"""A/B 事件的時間分桶彙總：minute / hour / day × model_name × model_version × page
+
+- 事件寫入時（main.write_ab_events）同步累加到 SQLite：事件數、點擊數、不重複使用者（HyperLogLog）
+- 每批事件先在記憶體合併成少數幾列，再以 UPSERT 增量寫入；HLL 以 SQL 函式 hll_merge 取各 register 最大值
+- 報表頁（ab_report.py）只讀這張表：一個月的 hour 資料每組只有約 720 列，不必重新掃描整份 ab_events.csv
+- 分桶時間一律為 UTC；minute / hour 粒度依 AB_ROLLUP_MINUTE_DAYS / AB_ROLLUP_HOUR_DAYS 保留，day 永久保留
+
+重建（例如舊的 ab_events.csv 還沒有 rollup）：python ab_rollups.py --rebuild
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+GRAINS = {"minute": "%Y-%m-%d %H:%M", "hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+RETENTION_DAYS = {
+    "minute": int(os.getenv("AB_ROLLUP_MINUTE_DAYS", "7")),
+    "hour": int(os.getenv("AB_ROLLUP_HOUR_DAYS", "180")),
+    "day": None,
+}
+PRUNE_INTERVAL = 3600  # 秒
+
+# HyperLogLog：2^10 個 register（1 KB，標準誤差約 3.2%），以 zlib 壓縮後存成 BLOB
+HLL_P = 10
+HLL_M = 1 << HLL_P
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_M)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ab_rollups (
+    grain TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    model_version INTEGER NOT NULL,
+    page TEXT NOT NULL,
+    events INTEGER NOT NULL,
+    clicks INTEGER NOT NULL,
+    users BLOB NOT NULL,
+    PRIMARY KEY (grain, bucket, model_name, model_version, page)
+) WITHOUT ROWID
+"""
+
+UPSERT = """
+INSERT INTO ab_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (grain, bucket, model_name, model_version, page) DO UPDATE SET
+    events = events + excluded.events,
+    clicks = clicks + excluded.clicks,
+    users = hll_merge(users, excluded.users)
+"""
+
+
+# === HyperLogLog ===
+def hll_new():
+    return np.zeros(HLL_M, dtype=np.uint8)
+
+
+def hll_add(registers, value):
+    h = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+    idx = h >> (64 - HLL_P)
+    rest = h & ((1 << (64 - HLL_P)) - 1)
+    rank = (64 - HLL_P) - rest.bit_length() + 1
+    if rank > registers[idx]:
+        registers[idx] = rank
+
+
+def hll_encode(registers):
+    return zlib.compress(registers.tobytes())
+
+
+def hll_decode(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+
+
+def hll_merge(a, b):
+    """SQLite 自訂函式：兩個 HLL 取 register 最大值"""
+    return hll_encode(np.maximum(hll_decode(a), hll_decode(b)))
+
+
+def hll_count(registers):
+    estimate = HLL_ALPHA * HLL_M * HLL_M / np.sum(np.ldexp(1.0, -registers.astype(np.int32)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * HLL_M and zeros:
+        estimate = HLL_M * np.log(HLL_M / zeros)  # 小基數修正（linear counting）
+    return int(round(estimate))
+
+
+# === 寫入端（FastAPI） ===
+def _utc(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+class ABRollups:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.create_function("hll_merge", 2, hll_merge, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")  # 報表頁讀取時不會擋住寫入
+            conn.execute(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def add(self, events):
+        """events：dict（timestamp / user_id / model_name / model_version / page / clicked），回傳更新的列數"""
+        groups = {}
+        for event in events:
+            ts = _utc(event["timestamp"])
+            for grain, fmt in GRAINS.items():
+                key = (grain, ts.strftime(fmt), event["model_name"], int(event["model_version"]), event.get("page") or "")
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = [0, 0, hll_new()]
+                group[0] += 1
+                group[1] += int(bool(event["clicked"]))
+                hll_add(group[2], event["user_id"])
+        rows = [(*key, n, clicks, hll_encode(users)) for key, (n, clicks, users) in groups.items()]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(UPSERT, rows)
+            if time.time() - self._last_prune > PRUNE_INTERVAL:
+                self.prune()
+        return len(rows)
+
+    def prune(self, now=None):
+        """刪除超過保留天數的 minute / hour 列"""
+        now = now or datetime.utcnow()
+        conn = self._connect()
+        with conn:
+            for grain, days in RETENTION_DAYS.items():
+                if days is not None:
+                    cutoff = (now - timedelta(days=days)).strftime(GRAINS[grain])
+                    conn.execute("DELETE FROM ab_rollups WHERE grain = ? AND bucket < ?", (grain, cutoff))
+        self._last_prune = time.time()
+
+    def rebuild(self, csv_path, chunksize=100_000):
+        """清空後由 ab_events.csv 重新彙總（沒有 page 欄的舊紀錄以空字串歸類）"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM ab_rollups")
+        total = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, on_bad_lines="skip"):
+            chunk["timestamp"] = pd.to_datetime(chunk["timestamp"], errors="coerce", utc=True)
+            chunk = chunk.dropna(subset=["timestamp", "model_name", "model_version"])
+            if "page" not in chunk.columns:
+                chunk["page"] = ""
+            chunk["page"] = chunk["page"].fillna("")
+            chunk["clicked"] = chunk["clicked"].astype(str).str.lower() == "true"
+            self.add(chunk.to_dict("records"))
+            total += len(chunk)
+        return total
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# === 讀取端（Streamlit 報表） ===
+def load_rollups(db_path, grain="hour", since=None, by=("model_name",), total=False):
+    """讀取某粒度的彙總並依 by 欄位合併（HLL 合併後再估計不重複使用者）
+
+    回傳欄位：bucket（UTC datetime）、by 欄位、events、clicks、unique_users、ctr；
+    total=True 時把所有時間桶合併成一列（不含 bucket 欄）
+    """
+    keys = list(by) if total else ["bucket", *by]
+    columns = [*keys, "events", "clicks", "unique_users", "ctr"]
+    if not os.path.exists(db_path):
+        return pd.DataFrame(columns=columns)
+    # 不用 mode=ro：WAL 資料庫的讀取端也需要建立 -shm；以 query_only 確保報表端不會寫入
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA query_only = 1")
+        query = "SELECT bucket, model_name, model_version, page, events, clicks, users FROM ab_rollups WHERE grain = ?"
+        params = [grain]
+        if since is not None:
+            query += " AND bucket >= ?"
+            params.append(_utc(since).strftime(GRAINS[grain]))
+        rows = conn.execute(query, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):  # 權限、WAL -shm 無法建立等問題要讓報表看得到
+            raise
+        return pd.DataFrame(columns=columns)  # 資料庫已建立但尚未有任何事件寫入
+    finally:
+        conn.close()
+
+    fields = {"model_name": 1, "model_version": 2, "page": 3}
+    groups = {}
+    for row in rows:
+        key = tuple(row[fields[name]] for name in by) if total else (row[0], *(row[fields[name]] for name in by))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [row[4], row[5], hll_decode(row[6])]
+        else:
+            group[0] += row[4]
+            group[1] += row[5]
+            group[2] = np.maximum(group[2], hll_decode(row[6]))
+    df = pd.DataFrame(
+        [(*key, n, clicks, hll_count(users)) for key, (n, clicks, users) in groups.items()],
+        columns=columns[:-1],
+    )
+    if not total:
+        df["bucket"] = pd.to_datetime(df["bucket"])
+    df["ctr"] = (df["clicks"] / df["events"]).where(df["events"] > 0)
+    return df.sort_values(keys).reset_index(drop=True) if keys else df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由 ab_events.csv 重建 A/B 事件 rollup")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--csv", default="/usr/mlflow/workspace/logs/ab_events.csv")
+    parser.add_argument("--db", default="/usr/mlflow/workspace/logs/ab_rollups.sqlite")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rollups = ABRollups(args.db)
+        print(f"✅ 已由 {rollups.rebuild(args.csv):,} 筆事件重建 {args.db}")
+        rollups.close()
+    for grain in GRAINS:
+        print(f"📊 {grain}：{len(load_rollups(args.db, grain, by=('model_name', 'model_version', 'page')))} 列")
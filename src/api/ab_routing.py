@@ -0,0 +1,138 @@
+"""A/B 分流：依設定檔權重、以 user_id 雜湊做穩定 (sticky) 分組，並可選擇一個 shadow 模型
+
+- 同一個 user_id（在同一個 salt 下）永遠分到同一組，換 salt 即重新洗牌
+- shadow 模型在背景執行緒推論，結果只寫入 log 供比較，不回傳給使用者、不增加回應延遲
+
+設定檔（AB_CONFIG_PATH，預設 /usr/mlflow/workspace/ab_config.json）：
+    {
+        "arms": {"AnimeRecsysModel": 50, "AnimeRecsysTFIDF": 50},
+        "shadow": "AnimeRecsysUserTopK",
+        "salt": "exp-2024-01"
+    }
+沒有設定檔時使用 DEFAULT_CONFIG。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+AB_CONFIG_PATH = os.getenv("AB_CONFIG_PATH", "/usr/mlflow/workspace/ab_config.json")
+DEFAULT_CONFIG = {
+    "arms": {"AnimeRecsysModel": 50, "AnimeRecsysTFIDF": 50},
+    "shadow": None,
+    "salt": "",
+}
+
+
+class ABRouter:
+    def __init__(self, arms, shadow=None, salt=""):
+        arms = {name: float(weight) for name, weight in arms.items() if float(weight) > 0}
+        if not arms:
+            raise ValueError("A/B 設定至少需要一個權重 > 0 的模型")
+        self.arms = arms
+        self.shadow = shadow or None
+        self.salt = salt
+        total = sum(arms.values())
+        self._names = list(arms)
+        self._cutoffs = []
+        acc = 0.0
+        for name in self._names:
+            acc += arms[name] / total
+            self._cutoffs.append(acc)
+
+    @classmethod
+    def from_config(cls, path=AB_CONFIG_PATH):
+        config = dict(DEFAULT_CONFIG)
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                config.update(json.load(f))
+            print(f"🔀 A/B config loaded from {path}")
+        return cls(config["arms"], config.get("shadow"), config.get("salt", ""))
+
+    def bucket(self, user_id):
+        """user_id → [0, 1) 的穩定數值"""
+        digest = hashlib.sha256(f"{self.salt}:{user_id}".encode()).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+    def choose(self, user_id):
+        point = self.bucket(user_id)
+        for name, cutoff in zip(self._names, self._cutoffs):
+            if point < cutoff:
+                return name
+        return self._names[-1]
+
+    def models(self):
+        """需要常駐的模型（各組 + shadow）"""
+        return self._names + ([self.shadow] if self.shadow else [])
+
+    def config(self):
+        return {"arms": self.arms, "shadow": self.shadow, "salt": self.salt}
+
+
+class ShadowRunner:
+    """在背景執行 shadow 模型並把結果寫成 jsonl；佇列滿時直接丟棄，不阻塞請求"""
+
+    def __init__(self, get_model, log_path, max_workers=1, max_pending=100):
+        self.get_model = get_model
+        self.log_path = log_path
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shadow")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, shadow_name, model_input, user_id, primary_name, primary_result):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending += 1
+        self._executor.submit(self._run, shadow_name, model_input, user_id, primary_name, primary_result)
+        return True
+
+    def _run(self, shadow_name, model_input, user_id, primary_name, primary_result):
+        try:
+            start = time.perf_counter()
+            result = self.get_model(shadow_name).predict(model_input)[0]
+            latency_ms = (time.perf_counter() - start) * 1000
+            overlap = len(set(result) & set(primary_result))
+            self._write({
+                "timestamp": time.time(),
+                "user_id": user_id,
+                "primary_model": primary_name,
+                "shadow_model": shadow_name,
+                "shadow_latency_ms": round(latency_ms, 2),
+                "overlap": overlap,
+                "overlap_ratio": overlap / max(len(primary_result), 1),
+                "primary_recommendations": list(primary_result),
+                "shadow_recommendations": list(result),
+            })
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"⚠️ Shadow {shadow_name} failed: {e}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _write(self, record):
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "log_path": self.log_path,
+            }
@@ -0,0 +1,95 @@
+"""目錄 delta 同步：把 Registry 中新發佈的 catalog delta 原地套用到快取中的模型
+
+delta 由 notebooks/src/pipeline/catalog_delta.py 上傳到「該模型版本的 run」底下的 catalog_deltas/；
+這裡定期（CATALOG_DELTA_SYNC_SECONDS，預設 60 秒，0 = 關閉）列出快取中每個模型對應 run 的 delta，
+下載尚未套用的檔案並呼叫 python_model.apply_delta()，不需要重新載入模型。
+
+若 stage 已經指向別的版本（例如 compact 後註冊的新版本），直接把舊模型移出快取，下次請求時載入新版本。
+"""
+import os
+import threading
+
+from mlflow.tracking import MlflowClient
+
+DELTA_ARTIFACT_DIR = "catalog_deltas"  # 與 notebooks/src/pipeline/catalog_delta.py 相同
+SYNC_SECONDS = float(os.getenv("CATALOG_DELTA_SYNC_SECONDS", "60"))
+
+
+class CatalogDeltaSync:
+    def __init__(self, model_cache, stage="Staging", interval=SYNC_SECONDS, client=None):
+        self.model_cache = model_cache
+        self.stage = stage
+        self.interval = interval
+        self._client = client
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.applied = 0
+        self.reloads = 0
+        self.errors = 0
+        self.last_error = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = MlflowClient()
+        return self._client
+
+    def sync(self, model_name, model=None):
+        """套用該模型尚未套用的 delta，回傳這次套用的 artifact 路徑"""
+        model = model or self.model_cache.peek(model_name)
+        if model is None:
+            return []
+        python_model = model.unwrap_python_model()
+        if not hasattr(python_model, "apply_delta"):
+            return []
+
+        with self._lock:
+            versions = self.client.get_latest_versions(model_name, stages=[self.stage])
+            if not versions:
+                return []
+            run_id = versions[0].run_id
+            if model.metadata.run_id != run_id:
+                print(f"🔄 {model_name} 的 {self.stage} 已換成 v{versions[0].version}，移出快取以重新載入")
+                self.model_cache.invalidate(model_name)
+                self.reloads += 1
+                return []
+
+            pending = sorted(
+                f.path for f in self.client.list_artifacts(run_id, DELTA_ARTIFACT_DIR)
+                if not f.is_dir and f.path.endswith(".npz") and f.path not in python_model.applied_deltas
+            )
+            for path in pending:
+                python_model.apply_delta(self.client.download_artifacts(run_id, path), name=path)
+            self.applied += len(pending)
+            return pending
+
+    def sync_all(self):
+        for name in self.model_cache.names():
+            try:
+                self.sync(name)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{name}: {e}"
+                print(f"⚠️ 同步 {name} 的目錄 delta 失敗：{e}")
+
+    def start(self):
+        if self.interval <= 0:
+            return self
+        threading.Thread(target=self._run, name="catalog-delta-sync", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sync_all()
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "applied": self.applied,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
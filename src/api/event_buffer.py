@@ -0,0 +1,160 @@
+"""A/B 事件的 client 端批次緩衝：累積後一次送到 FastAPI POST /log-ab-events
+
+原本每次點擊都同步呼叫一次 /log-ab-event；改成先放進緩衝區，以下任一條件成立才送出：
+- 累積 max_events 筆
+- 第一筆事件進入緩衝區後 flush_interval 秒（背景 timer 送出，使用者停止操作或關掉分頁也不會遺失）
+- 呼叫端明確 flush()（例如切換頁面、程式結束）
+
+送出失敗的事件會保留下來等下次重送（最多 max_pending 筆，超過時丟棄最舊的）；
+失敗後 flush_interval 秒內不再自動重送（由 timer 稍後重試），API 掛掉時不會讓每次點擊都卡在連線逾時。
+尚有事件未送出的緩衝區由模組層級的 _unflushed 保留強參照：Streamlit 丟掉 session 後仍會由 timer 或
+程式結束時的 flush_all 送出。
+
+一般 client：
+    buffer = EventBuffer("http://fastapi:8000")
+    buffer.add({"user_id": "josh", "model_name": "AnimeRecsysModel", ...})
+    buffer.flush()
+
+Streamlit 頁面（緩衝區存在 session_state，換頁時自動送出）：
+    buffer = session_buffer(FASTAPI_URL, page="ab_random")
+    buffer.add(event)
+"""
+import os
+import time
+import atexit
+import threading
+from datetime import datetime
+
+import requests
+
+MAX_EVENTS = int(os.getenv("AB_EVENT_BATCH_SIZE", "20"))
+FLUSH_INTERVAL = float(os.getenv("AB_EVENT_FLUSH_SECONDS", "15"))
+MAX_PENDING = 1000
+
+_unflushed = set()  # 還有事件未送出的緩衝區（強參照，直到送出為止）
+_unflushed_lock = threading.Lock()
+
+
+class EventBuffer:
+    def __init__(self, api_url, max_events=MAX_EVENTS, flush_interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING, timeout=5, session=None):
+        self.endpoint = f"{api_url.rstrip('/')}/log-ab-events"
+        self.max_events = max_events
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.retry_after = 0.0
+        self.sent = 0
+        self.requests = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, event):
+        """加入一筆事件（dict，欄位同 ABEvent）；達到條件時順便送出，回傳 False 表示這次送出失敗"""
+        event = dict(event)
+        event.setdefault("timestamp", datetime.utcnow().isoformat())
+        with self._lock:
+            self.pending.append(event)
+            overflow = len(self.pending) - self.max_pending
+            if overflow > 0:
+                del self.pending[:overflow]
+                self.dropped += overflow
+            self._arm(self.flush_interval)
+        return self.maybe_flush()
+
+    def _arm(self, delay):
+        """（持有 self._lock 時呼叫）有待送事件且尚未排程時，delay 秒後由背景 timer 送出"""
+        with _unflushed_lock:
+            _unflushed.add(self)
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        if not self.flush():
+            with self._lock:
+                if self.pending:
+                    self._arm(max(self.retry_after - time.monotonic(), 0.0))
+
+    def due(self):
+        if not self.pending or time.monotonic() < self.retry_after:
+            return False
+        return (
+            len(self.pending) >= self.max_events
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        )
+
+    def maybe_flush(self):
+        """達到批次大小或時間間隔才送出；回傳 False 表示送出失敗（事件仍保留）"""
+        return self.flush() if self.due() else True
+
+    def flush(self):
+        """把目前緩衝的事件一次送出；成功或沒有事件時回傳 True"""
+        with self._lock:
+            batch, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+        if not batch:
+            self._release()
+            return True
+        try:
+            r = self.session.post(self.endpoint, json=batch, timeout=self.timeout)
+            r.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ A/B 事件送出失敗（{len(batch)} 筆保留待重送）：{e}")
+            with self._lock:
+                self.retry_after = time.monotonic() + self.flush_interval
+                self.pending[:0] = batch
+                overflow = len(self.pending) - self.max_pending
+                if overflow > 0:
+                    del self.pending[:overflow]
+                    self.dropped += overflow
+            return False
+        with self._lock:
+            self.sent += len(batch)
+            self.requests += 1
+        self._release()
+        return True
+
+    def _release(self):
+        """緩衝區已清空：取消 timer、不再保留強參照"""
+        with self._lock:
+            if self.pending:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with _unflushed_lock:
+            _unflushed.discard(self)
+
+    def stats(self):
+        return {"pending": len(self.pending), "sent": self.sent, "requests": self.requests, "dropped": self.dropped}
+
+
+@atexit.register
+def flush_all():
+    with _unflushed_lock:
+        buffers = list(_unflushed)
+    for buffer in buffers:
+        buffer.flush()
+
+
+def session_buffer(api_url, page=None):
+    """取得目前 Streamlit session 的 EventBuffer；偵測到換頁時先把上一頁累積的事件送出"""
+    import streamlit as st
+
+    buffer = st.session_state.get("_ab_event_buffer")
+    if buffer is None:
+        buffer = st.session_state["_ab_event_buffer"] = EventBuffer(api_url)
+    if page is not None and st.session_state.get("_ab_event_page") != page:
+        st.session_state["_ab_event_page"] = page
+        buffer.flush()
+    else:
+        buffer.maybe_flush()
+    return buffer
@@ -1,14 +1,23 @@
 import mlflow
 import mlflow.pyfunc
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from pydantic import BaseModel, ValidationError
 import pandas as pd
 import os
 import csv
+import time
+import threading
 from datetime import datetime
-import random
 from typing import Optional
 
+from model_cache import ModelCache
+from ab_routing import ABRouter, ShadowRunner
+from catalog_sync import CatalogDeltaSync
+from request_capture import RequestCapture
+from ab_rollups import ABRollups
+from request_profiler import RequestProfiler, stage
+from mlflow.tracking import MlflowClient
+
 app = FastAPI(
     title="Anime Recommender API",
     description="FastAPI + MLflow 企業級推薦系統",
@@ -32,21 +41,106 @@ class ABEvent(BaseModel):
     recommended_title: Optional[str] = None
     clicked: bool
     timestamp: datetime = datetime.utcnow()
+    page: Optional[str] = None
 
 # === 設定 MLflow ===
 mlflow.set_tracking_uri("http://mlflow:5000")
-model_cache = {}  # 模型快取，避免重複載入
+LOG_DIR = "/usr/mlflow/workspace/logs"
+
+# 模型名稱 → 目前載入的 Registry 版本（請求擷取時一併記錄）
+model_versions = {}
+
+def load_staging_model(model_name: str):
+    versions = MlflowClient().get_latest_versions(model_name, stages=["Staging"])
+    if not versions:
+        raise LookupError(f"No Staging version for {model_name}")
+    model_uri = f"models:/{model_name}/{versions[0].version}"
+    print(f"📦 Loading {model_uri} (Staging) ...")
+    model = mlflow.pyfunc.load_model(model_uri)
+    model_versions[model_name] = int(versions[0].version)
+    return model
+
+# 模型快取：依記憶體上限 (MODEL_CACHE_BUDGET_MB) 做 LRU 淘汰，A/B 分流中的模型常駐
+ab_router = ABRouter.from_config()
+model_cache = ModelCache(load_staging_model)
+model_cache.pin(*ab_router.models())
 
 def get_model(model_name: str):
     """依照模型名稱載入模型，若不存在則回傳 404"""
-    if model_name not in model_cache:
-        model_uri = f"models:/{model_name}/Staging"
-        print(f"📦 Loading {model_uri} ...")
-        try:
-            model_cache[model_name] = mlflow.pyfunc.load_model(model_uri)
-        except Exception:
-            raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found in Registry.")
-    return model_cache[model_name]
+    try:
+        return model_cache.get(model_name)
+    except Exception:
+        raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found in Registry.")
+
+shadow_runner = ShadowRunner(model_cache.get, os.path.join(LOG_DIR, "shadow_events.jsonl"))
+
+# 目錄 delta：背景定期把新發佈的 delta 原地套用到快取中的模型（CATALOG_DELTA_SYNC_SECONDS）
+catalog_sync = CatalogDeltaSync(model_cache).start()
+
+# 請求擷取：依 REQUEST_CAPTURE_RATE 抽樣記錄輸入 / 輸出 / 版本 / 延遲，供 replay.py 離線重播
+request_capture = RequestCapture(os.path.join(LOG_DIR, "captures")).start()
+
+def capture(endpoint: str, model_name: str, request: RecommendRequest, recommendations, started: float):
+    if request_capture.sampled():
+        request_capture.record(
+            endpoint, model_name, model_versions.get(model_name), request.user_id,
+            request.anime_titles, recommendations, (time.perf_counter() - started) * 1000,
+        )
+
+# 慢請求診斷：每個請求記錄階段耗時；PROFILE_SAMPLE_RATE 抽樣或帶 X-Profile-Token 的請求另做 stack 取樣，
+# 超過 SLOW_REQUEST_MS 的請求寫入 <LOG_DIR>/slow_requests
+request_profiler = RequestProfiler(os.path.join(LOG_DIR, "slow_requests"))
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    trace, token = request_profiler.begin(request.method, request.url.path, request.url.query, request.headers)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        request_profiler.end(trace, token, status_code, (time.perf_counter() - started) * 1000)
+
+@app.get("/debug/slow-requests")
+def slow_requests(limit: int = Query(20, ge=1, le=200)):
+    return {"stats": request_profiler.stats(), "requests": request_profiler.recent(limit)}
+
+@app.get("/debug/slow-requests/{request_id}")
+def slow_request_detail(request_id: str):
+    record = request_profiler.get(request_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Slow request '{request_id}' not found.")
+    return record
+
+# === 模型快取狀態 ===
+@app.get("/models/cache")
+def model_cache_stats():
+    return model_cache.stats()
+
+# === 立即同步目錄 delta（不等背景排程） ===
+@app.post("/models/{model_name}/catalog/sync")
+def sync_catalog(model_name: str):
+    model = get_model(model_name)
+    try:
+        applied = catalog_sync.sync(model_name, model)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to apply catalog deltas: {e}")
+    python_model = model.unwrap_python_model()
+    return {
+        "model_name": model_name,
+        "applied": applied,
+        "applied_total": list(getattr(python_model, "applied_deltas", [])),
+        "catalog_size": len(python_model.catalog()) if hasattr(python_model, "catalog") else None,
+        "sync": catalog_sync.stats(),
+    }
+
+def build_model_input(request: RecommendRequest) -> pd.DataFrame:
+    """第 0 欄為片名；另附 user_id 欄，個人化模型（AnimeRecsysUserTopK）據此查預先算好的推薦表"""
+    df = pd.DataFrame(request.anime_titles)
+    df["user_id"] = request.user_id
+    return df
 
 # === 推薦 API ===
 @app.post("/recommend")
@@ -54,9 +148,12 @@ def recommend(request: RecommendRequest, model_name: str = Query("AnimeRecsysMod
     try:
         if not request.anime_titles:
             raise HTTPException(status_code=400, detail="anime_titles cannot be empty.")
-        model = get_model(model_name)
-        df = pd.DataFrame(request.anime_titles)
-        result = model.predict(df)
+        with stage("get_model"):
+            model = get_model(model_name)
+        started = time.perf_counter()
+        with stage("predict"):
+            result = model.predict(build_model_input(request))
+        capture("/recommend", model_name, request, result[0], started)
         return {
             "model_name": model_name,
             "input": request.anime_titles,
@@ -69,22 +166,39 @@ def recommend(request: RecommendRequest, model_name: str = Query("AnimeRecsysMod
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Error: {str(e)}")
 
-# === 改為真正隨機分流，模擬真實 A/B Test ===
-def choose_model_by_time():
-    return random.choice(["AnimeRecsysModel", "AnimeRecsysTFIDF"])
+# === 推薦解釋：預先算好的 TF-IDF 前 N 詞，直接查表 ===
+@app.get("/explain/{anime_id}")
+def explain(anime_id: int, model_name: str = Query("AnimeRecsysTFIDF"), top_n: Optional[int] = Query(None, ge=1)):
+    with stage("get_model"):
+        model = get_model(model_name)
+    python_model = model.unwrap_python_model()
+    if not hasattr(python_model, "explain"):
+        raise HTTPException(status_code=400, detail=f"Model '{model_name}' does not support explanations.")
+    with stage("explain"):
+        result = python_model.explain(anime_id, top_n)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No explanation for anime_id={anime_id} in '{model_name}'.")
+    return {"model_name": model_name, **result}
 
 # === A/B 測試端點 ===
 @app.post("/recommend_ab")
 def recommend_ab(request: RecommendRequest):
-    """根據時間自動分流"""
+    """依 user_id 雜湊穩定分流；有 shadow 模型時在背景推論並記錄，不影響回應"""
     if not request.anime_titles:
         raise HTTPException(status_code=400, detail="anime_titles cannot be empty.")
-    
-    model_name = choose_model_by_time()
-    model = get_model(model_name)
-    result = model.predict(pd.DataFrame(request.anime_titles))
+
+    model_name = ab_router.choose(request.user_id)
+    with stage("get_model"):
+        model = get_model(model_name)
+    model_input = build_model_input(request)
+    started = time.perf_counter()
+    with stage("predict"):
+        result = model.predict(model_input)
+    capture("/recommend_ab", model_name, request, result[0], started)
 
     print(f"🧠 User={request.user_id} 使用模型: {model_name}")
+    if ab_router.shadow:
+        shadow_runner.submit(ab_router.shadow, model_input, request.user_id, model_name, result[0])
 
     return {
         "endpoint": "/recommend_ab",
@@ -94,27 +208,63 @@ def recommend_ab(request: RecommendRequest):
         "timestamp": datetime.utcnow().isoformat()
     }
 
+# === 請求擷取狀態 ===
+@app.get("/capture/stats")
+def capture_stats():
+    return request_capture.stats()
+
+# === A/B 分流設定與 shadow 狀態 ===
+@app.get("/ab/config")
+def ab_config():
+    return {**ab_router.config(), "shadow_stats": shadow_runner.stats()}
+
 # === AB Test 紀錄 API ===
-@app.post("/log-ab-event")
-def log_ab_event(event: ABEvent):
-    LOG_DIR = "/usr/mlflow/workspace/logs"
+AB_EVENT_COLUMNS = ["timestamp", "user_id", "model_name", "model_version", "recommended_title", "clicked", "page"]
+MAX_EVENTS_PER_BATCH = 1000
+ab_log_lock = threading.Lock()
+
+# 分鐘 / 小時 / 天的 CTR 彙總（報表頁的趨勢圖只讀這裡，不重新掃描 ab_events.csv）
+ab_rollups = ABRollups(os.path.join(LOG_DIR, "ab_rollups.sqlite"))
+
+def write_ab_events(events: list[ABEvent]):
+    """一次開檔寫入多筆事件；以 lock 避免同時寫入的列交錯"""
     os.makedirs(LOG_DIR, exist_ok=True)
     log_path = os.path.join(LOG_DIR, "ab_events.csv")
-
-    try:
+    rows = [event.dict() for event in events]
+    with stage("write_csv"), ab_log_lock:
         file_exists = os.path.isfile(log_path)
+        columns = AB_EVENT_COLUMNS
+        if file_exists:
+            # 沿用既有檔案的欄位（舊檔沒有 page 欄），避免欄數不一致的列被報表略過
+            with open(log_path, newline="", encoding="utf-8") as f:
+                columns = next(csv.reader(f), AB_EVENT_COLUMNS)
         with open(log_path, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
             if not file_exists:
-                writer.writerow(["timestamp", "user_id", "model_name", "model_version", "recommended_title", "clicked"])
-            writer.writerow([
-                event.timestamp.isoformat(),
-                event.user_id,
-                event.model_name,
-                event.model_version,
-                event.recommended_title,
-                event.clicked
-            ])
+                writer.writeheader()
+            writer.writerows({**row, "timestamp": row["timestamp"].isoformat()} for row in rows)
+    try:
+        with stage("rollups"):
+            ab_rollups.add(rows)
+    except Exception as e:
+        # rollup 可由 ab_events.csv 重建（python ab_rollups.py --rebuild），不讓事件寫入失敗
+        print(f"⚠️ A/B rollup 更新失敗：{e}")
+
+@app.post("/log-ab-event")
+def log_ab_event(event: ABEvent):
+    try:
+        write_ab_events([event])
         return {"message": "Event logged successfully ✅", "event": event.dict()}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to write log: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to write log: {e}")
+
+# === AB Test 批次紀錄 API（client 端以 event_buffer.EventBuffer 累積後送出） ===
+@app.post("/log-ab-events")
+def log_ab_events(events: list[ABEvent]):
+    if len(events) > MAX_EVENTS_PER_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_EVENTS_PER_BATCH} events per batch.")
+    try:
+        write_ab_events(events)
+        return {"message": "Events logged successfully ✅", "count": len(events)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to write log: {e}")
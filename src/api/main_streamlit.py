@@ -6,12 +6,17 @@ import streamlit as st
 import requests
 from datetime import datetime
 
+from event_buffer import session_buffer
+
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://localhost:8000")
 ANIME_CSV_PATH = "/src/api/notebooks/data/anime_clean.csv"
 
 st.set_page_config(page_title="🎬 Anime Recommender", layout="wide")
 st.title("🎬 Anime Recommendation System")
 
+# 點擊事件先在 session 內累積，達到批次大小、超過時間或換頁時才一次送出
+event_buffer = session_buffer(FASTAPI_URL, page="main")
+
 st.markdown("""
 這是一個基於 **MLflow + FastAPI** 的推薦系統展示 🎯  
 請輸入暱稱並選擇你喜歡的動畫，我們會為你推薦相似作品！
@@ -55,23 +60,20 @@ def get_recommendations(user_id: str, anime_titles: list[str]):
 
 
 def log_click_event(user_id: str, model_name: str, model_version: int, title: str):
-    """呼叫 FastAPI /log-ab-event 紀錄使用者行為"""
+    """把點擊事件放進本 session 的緩衝區，累積一批後再送到 FastAPI /log-ab-events"""
     event = {
         "user_id": user_id,
         "model_name": model_name,
         "model_version": model_version,
         "recommended_title": title,
         "clicked": True,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
+        "page": "main"
     }
-    try:
-        r = requests.post(f"{FASTAPI_URL}/log-ab-event", json=event)
-        if r.status_code == 200:
-            st.toast(f"✅ 已紀錄點擊：{title}")
-        else:
-            st.warning(f"⚠️ 紀錄失敗：{r.text}")
-    except requests.exceptions.RequestException:
-        st.warning("⚠️ 無法連線至 FastAPI。")
+    if event_buffer.add(event):
+        st.toast(f"🕒 已加入待送出的點擊：{title}（稍後批次送出）")
+    else:
+        st.warning("⚠️ 無法連線至 FastAPI，事件將於下次重送。")
 
 
 # --- Step 5. 取得推薦結果 ---
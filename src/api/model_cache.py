@@ -0,0 +1,181 @@
+"""有記憶體上限的模型快取（LRU 淘汰，A/B 分流中的模型可 pin 住常駐）
+
+- 每個模型載入後估算佔用記憶體（numpy / scipy.sparse / DataFrame / 字串等屬性的大小總和）
+- 總量超過 budget 時，從最久沒用到、且沒有被 pin 的模型開始淘汰
+- mmap 開啟的陣列由 OS page cache 管理，不計入 budget
+
+環境變數：
+    MODEL_CACHE_BUDGET_MB   記憶體上限，預設 2048 MB
+    MODEL_CACHE_PINNED      以逗號分隔的常駐模型名稱
+"""
+import os
+import sys
+import mmap
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+DEFAULT_BUDGET_BYTES = int(os.getenv("MODEL_CACHE_BUDGET_MB", "2048")) * 1024 * 1024
+DEFAULT_PINNED = [name for name in os.getenv("MODEL_CACHE_PINNED", "").split(",") if name]
+
+
+def estimate_bytes(obj, _seen=None, _depth=0):
+    """粗估物件佔用的記憶體（遞迴走訪屬性 / 容器，同一物件只算一次）"""
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen or _depth > 8:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        # mmap 的陣列（或其 view）不佔 heap
+        base = obj
+        while isinstance(base, np.ndarray) and base.base is not None:
+            base = base.base
+        return 0 if isinstance(base, (np.memmap, mmap.mmap)) else obj.nbytes
+    if sp.issparse(obj):
+        return sum(getattr(obj, name).nbytes for name in ("data", "indices", "indptr", "row", "col")
+                   if isinstance(getattr(obj, name, None), np.ndarray))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_bytes(k, _seen, _depth + 1) + estimate_bytes(v, _seen, _depth + 1) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_bytes(v, _seen, _depth + 1) for v in obj)
+    if hasattr(obj, "__dict__") and not isinstance(obj, type):
+        return sys.getsizeof(obj) + estimate_bytes(vars(obj), _seen, _depth + 1)
+    return sys.getsizeof(obj)
+
+
+def model_footprint(model):
+    """pyfunc 模型的記憶體估計：解開 PyFuncModel 後估算實際的 python_model / flavor 物件"""
+    try:
+        inner = model.unwrap_python_model()
+    except Exception:
+        inner = getattr(model, "_model_impl", model)
+    return estimate_bytes(inner)
+
+
+class ModelCache:
+    def __init__(self, loader, budget_bytes=DEFAULT_BUDGET_BYTES, pinned=DEFAULT_PINNED, sizer=model_footprint):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.sizer = sizer
+        self.pinned = set(pinned)
+        self._entries = OrderedDict()  # name → {"model", "bytes", "loaded_at", "last_used", "hits"}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.evictions = []  # 最近的淘汰紀錄
+
+    @property
+    def used_bytes(self):
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._touch(name, entry)
+                return entry["model"]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # 同一個模型只讓一個 thread 載入，其他 thread 等它完成
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    self._touch(name, entry)
+                    return entry["model"]
+            model = self.loader(name)
+            size = self.sizer(model)
+            now = time.time()
+            with self._lock:
+                self.misses += 1
+                self._entries[name] = {"model": model, "bytes": size, "loaded_at": now, "last_used": now, "hits": 0}
+                self._evict(keep=name)
+            print(f"📦 Cached {name}（約 {size / 1024 / 1024:.1f} MB，總計 {self.used_bytes / 1024 / 1024:.1f} MB）")
+            return model
+
+    def _touch(self, name, entry):
+        self.hits += 1
+        entry["hits"] += 1
+        entry["last_used"] = time.time()
+        self._entries.move_to_end(name)
+
+    def _evict(self, keep=None):
+        """呼叫端需持有 self._lock；從 LRU 端開始淘汰未 pin 的模型"""
+        for name in list(self._entries):
+            if self.used_bytes <= self.budget_bytes:
+                break
+            if name == keep or name in self.pinned:
+                continue
+            entry = self._entries.pop(name)
+            self.evicted += 1
+            self.evictions.append({"name": name, "bytes": entry["bytes"], "evicted_at": time.time()})
+            self.evictions = self.evictions[-50:]
+            print(f"🧹 Evicted {name}（{entry['bytes'] / 1024 / 1024:.1f} MB）")
+
+    def pin(self, *names):
+        with self._lock:
+            self.pinned.update(names)
+
+    def set_pinned(self, names):
+        """以新的名單取代 pin 清單（例如 A/B 分流設定改變時），並依 budget 重新淘汰"""
+        with self._lock:
+            self.pinned = set(names)
+            self._evict()
+
+    def invalidate(self, name=None):
+        """移除單一模型（或全部），下次請求時重新從 Registry 載入"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def peek(self, name):
+        """只查快取、不載入也不計入 hit（背景工作用）"""
+        entry = self._entries.get(name)
+        return None if entry is None else entry["model"]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self.used_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted_total": self.evicted,
+                "recent_evictions": list(self.evictions[-10:]),
+                "models": [
+                    {
+                        "name": name,
+                        "bytes": entry["bytes"],
+                        "pinned": name in self.pinned,
+                        "hits": entry["hits"],
+                        "loaded_at": entry["loaded_at"],
+                        "last_used": entry["last_used"],
+                    }
+                    for name, entry in reversed(self._entries.items())
+                ],
+            }
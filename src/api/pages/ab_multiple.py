@@ -6,12 +6,17 @@ import requests
 import streamlit as st
 from datetime import datetime
 
+from event_buffer import session_buffer
+
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://localhost:8000")
 ANIME_CSV_PATH = "/src/api/notebooks/data/anime_clean.csv"
 
 st.set_page_config(page_title="⚖️ 雙模型推薦比較", layout="wide")
 st.title("⚖️ 雙模型推薦比較頁")
 
+# 事件先在 session 內累積，達到批次大小、超過時間或換頁時才一次送出
+event_buffer = session_buffer(FASTAPI_URL, page="ab_multiple")
+
 st.markdown("""
 本頁同時顯示兩個模型的推薦結果，  
 使用者可對比推薦清單並提供正負反饋，  
@@ -53,12 +58,8 @@ def log_click_event(user_id, model_name, model_version, title, page, clicked=Tru
         "timestamp": datetime.utcnow().isoformat(),
         "page": page
     }
-    try:
-        r = requests.post(f"{FASTAPI_URL}/log-ab-event", json=event)
-        if r.status_code != 200:
-            st.warning(f"⚠️ 記錄失敗：{r.text}")
-    except requests.exceptions.RequestException:
-        st.warning("⚠️ 無法連線至 FastAPI")
+    if not event_buffer.add(event):
+        st.warning("⚠️ 無法連線至 FastAPI，事件將於下次重送。")
 
 if st.button("🚀 取得雙模型推薦結果"):
     if not nickname:
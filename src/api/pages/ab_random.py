@@ -6,14 +6,19 @@ import requests
 import streamlit as st
 from datetime import datetime
 
+from event_buffer import session_buffer
+
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://localhost:8000")
 ANIME_CSV_PATH = "/src/api/notebooks/data/anime_clean.csv"
 
 st.set_page_config(page_title="🎲 隨機分流推薦", layout="wide")
 st.title("🎲 A/B Test 隨機分流頁")
 
+# 事件先在 session 內累積，達到批次大小、超過時間或換頁時才一次送出
+event_buffer = session_buffer(FASTAPI_URL, page="ab_random")
+
 st.markdown("""
-本頁使用 FastAPI `/recommend_ab` 隨機分流至不同模型，  
+本頁使用 FastAPI `/recommend_ab` 依暱稱 (user_id) 雜湊穩定分流至不同模型，  
 並新增「我都不喜歡」按鈕記錄負樣本，使 CTR 統計更真實。
 """)
 
@@ -51,10 +56,8 @@ def log_click_event(user_id, model_name, model_version, title, page, clicked=Tru
         "timestamp": datetime.utcnow().isoformat(),
         "page": page
     }
-    try:
-        requests.post(f"{FASTAPI_URL}/log-ab-event", json=event)
-    except requests.exceptions.RequestException:
-        st.warning("⚠️ 無法記錄事件")
+    if not event_buffer.add(event):
+        st.warning("⚠️ 無法記錄事件，事件將於下次重送。")
 
 if st.button("🚀 取得隨機推薦結果"):
     if not nickname:
@@ -1,58 +1,78 @@
 # 📊 A/B Test 結果分析頁（/src/api/pages/ab_report.py）
 
+import io
 import os
+from datetime import datetime, timedelta
+
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 
+from event_buffer import session_buffer
+from ab_rollups import load_rollups
+
 # ✅ 正確路徑：本機 workspace/logs 對應容器 /src/api/workspace/logs
 LOG_PATH = "/src/api/workspace/logs/ab_events.csv"
+ROLLUP_PATH = "/src/api/workspace/logs/ab_rollups.sqlite"
+TAIL_BYTES = 64 * 1024
+GRAIN_LABELS = {"minute": "分鐘", "hour": "小時", "day": "天"}
 
 st.set_page_config(page_title="📊 AB Test 分析", layout="wide")
 st.title("📊 A/B Test 結果分析")
 
+# 從推薦頁切換過來時，先把 session 內尚未送出的事件寫入，報表才看得到最新點擊
+session_buffer(os.getenv("FASTAPI_URL", "http://localhost:8000"), page="ab_report")
+
 st.markdown("""
-此頁面會從 `ab_events.csv` 中讀取紀錄，  
-分析兩個推薦模型的表現差異（點擊率、使用者數、事件數）。
+此頁面讀取 FastAPI 寫入的分桶彙總 `ab_rollups.sqlite`（分鐘 / 小時 / 天），  
+分析推薦模型的表現差異與趨勢（點擊率、使用者數、事件數）。不重新掃描整份 `ab_events.csv`，  
+不重複使用者為 HyperLogLog 估計值（誤差約 3%）。
 """)
 
-# --- Step 1. 讀取紀錄檔 ---
+# --- Step 1. 讀取紀錄 ---
 @st.cache_data(ttl=5.0)
-def load_logs():
+def load_recent_events(n=10):
+    """只讀 ab_events.csv 檔尾，顯示最新事件"""
     if not os.path.exists(LOG_PATH):
-        st.warning("⚠️ 找不到 ab_events.csv")
         return pd.DataFrame()
-    df = pd.read_csv(LOG_PATH, on_bad_lines="skip")
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    return df
+    with open(LOG_PATH, "rb") as f:
+        header = f.readline()
+        start = os.path.getsize(LOG_PATH) - TAIL_BYTES
+        if start > f.tell():
+            f.seek(start)
+            f.readline()  # 丟掉被截斷的第一行
+        tail = f.read()
+    return pd.read_csv(io.BytesIO(header + tail), on_bad_lines="skip").tail(n)
 
-# 🔄 側邊欄：重新整理報表
+@st.cache_data(ttl=5.0)
+def load_trend(grain, days, by, total=False):
+    since = None if days is None else datetime.utcnow() - timedelta(days=days)
+    return load_rollups(ROLLUP_PATH, grain, since=since, by=by, total=total)
+
+# 🔄 側邊欄：重新整理報表、趨勢圖設定
 st.sidebar.markdown("### 🔄 重新整理報表")
 if st.sidebar.button("重新載入資料"):
     st.cache_data.clear()
     st.rerun()
 
-df = load_logs()
-st.info(f"📦 已載入 {len(df)} 筆事件紀錄。")
-if df.empty:
-    st.stop()
+st.sidebar.markdown("### 📈 趨勢圖")
+grain = st.sidebar.selectbox("時間粒度", ["hour", "day", "minute"], format_func=GRAIN_LABELS.get)
+days = st.sidebar.selectbox("時間範圍（天）", [1, 7, 30, 90], index=1)
 
+df = load_recent_events()
 st.markdown("### 🧾 最新事件紀錄（最近 10 筆）")
-st.dataframe(df.tail(10), use_container_width=True)
-
-# --- Step 2. 統計每個模型的點擊狀況 ---
-summary = (
-    df.groupby("model_name")
-    .agg(
-        total_clicks=("clicked", "sum"),
-        unique_users=("user_id", pd.Series.nunique),
-        total_events=("user_id", "count"),
-    )
-    .reset_index()
-)
+st.dataframe(df, use_container_width=True)
+
+# --- Step 2. 統計每個模型的點擊狀況（day 彙總合併為全期間，每個模型一列） ---
+summary = load_trend("day", None, ("model_name",), total=True)
+if summary.empty:
+    st.warning("⚠️ 尚無 A/B 事件彙總（ab_rollups.sqlite）；舊紀錄可執行 python ab_rollups.py --rebuild 建立")
+    st.stop()
+st.info(f"📦 共 {int(summary['events'].sum())} 筆事件紀錄。")
 
-summary["CTR(%)"] = round(summary["total_clicks"] / summary["total_events"] * 100, 2)
+summary = summary.rename(columns={"clicks": "total_clicks", "events": "total_events"})
+summary["CTR(%)"] = round(summary["ctr"] * 100, 2)
+summary = summary.drop(columns="ctr")
 
 st.markdown("### 📈 模型表現摘要")
 st.dataframe(summary, use_container_width=True)
@@ -82,4 +102,30 @@ fig2 = px.bar(
 fig2.update_traces(textposition="outside")
 st.plotly_chart(fig2, use_container_width=True)
 
+# --- Step 4. 趨勢圖（只讀 rollup：每組每個時間桶一列） ---
+st.markdown(f"### 📉 點擊率趨勢（最近 {days} 天，每{GRAIN_LABELS[grain]}）")
+trend = load_trend(grain, days, ("model_name",))
+if trend.empty:
+    st.info("ℹ️ 此時間範圍內沒有事件。")
+else:
+    trend["CTR(%)"] = round(trend["ctr"] * 100, 2)
+    fig3 = px.line(trend, x="bucket", y="CTR(%)", color="model_name", markers=True, title="各模型點擊率隨時間變化")
+    st.plotly_chart(fig3, use_container_width=True)
+    fig4 = px.bar(trend, x="bucket", y="events", color="model_name", title="各模型事件數")
+    st.plotly_chart(fig4, use_container_width=True)
+
+    st.markdown("### 🏷️ 各版本點擊率趨勢")
+    versions = load_trend(grain, days, ("model_name", "model_version"))
+    versions["version"] = versions["model_name"] + " v" + versions["model_version"].astype(str)
+    versions["CTR(%)"] = round(versions["ctr"] * 100, 2)
+    fig5 = px.line(versions, x="bucket", y="CTR(%)", color="version", markers=True, title="各模型版本點擊率隨時間變化")
+    st.plotly_chart(fig5, use_container_width=True)
+
+    st.markdown("### 🧭 各頁面點擊率")
+    pages = load_trend(grain, days, ("page",))
+    pages["page"] = pages["page"].replace("", "(未標記)")
+    pages["CTR(%)"] = round(pages["ctr"] * 100, 2)
+    fig6 = px.line(pages, x="bucket", y="CTR(%)", color="page", markers=True, title="各頁面點擊率隨時間變化")
+    st.plotly_chart(fig6, use_container_width=True)
+
 st.success("✅ 分析完成！您可以透過此頁面觀察模型互動差異。")
@@ -0,0 +1,128 @@
+"""離線重播：把 request_capture.py 擷取到的真實流量送進任意 Registry 版本，比較延遲與推薦結果
+
+- 每個候選模型以批次方式跑完全部擷取紀錄（先暖機一次），統計 p50 / p95 / p99 / 平均延遲
+- overlap@k：候選模型的推薦與「當時線上回傳的結果」重疊比例；多個候選時另外與第一個候選比較
+- 模型可指定 版本 或 stage：AnimeRecsysTFIDF/3、AnimeRecsysTFIDF/Staging，
+  也可直接給 models:/ 或 runs:/ URI
+
+用法（FastAPI 容器內）：
+    python replay.py --models AnimeRecsysTFIDF/Staging AnimeRecsysTFIDF/5 --limit 2000 --out replay.csv
+"""
+import os
+import csv
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.pyfunc
+
+from request_capture import read_captures
+
+DEFAULT_CAPTURE_DIR = "/usr/mlflow/workspace/logs/captures"
+
+
+def model_uri(spec):
+    if ":/" in spec:
+        return spec
+    return f"models:/{spec}"
+
+
+def build_model_input(record):
+    """與 main.build_model_input 相同：第 0 欄為片名，另附 user_id 欄"""
+    df = pd.DataFrame(record["anime_titles"])
+    df["user_id"] = record["user_id"]
+    return df
+
+
+def overlap(a, b):
+    """overlap@k：以較長的一方為分母，兩邊皆空時視為完全一致"""
+    k = max(len(a), len(b))
+    return len(set(a) & set(b)) / k if k else 1.0
+
+
+def replay(model, records):
+    """回傳每筆紀錄的 (推薦結果, 延遲 ms)；個別請求出錯時結果為 None"""
+    results, latencies = [], []
+    if records:
+        model.predict(build_model_input(records[0]))  # 暖機（lazy 載入、快取）
+    for record in records:
+        started = time.perf_counter()
+        try:
+            result = list(model.predict(build_model_input(record))[0])
+        except Exception as e:
+            print(f"⚠️ {record['ts']} 重播失敗：{e}")
+            result = None
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(result)
+    return results, latencies
+
+
+def summarize(spec, records, results, latencies, reference=None):
+    ok = [i for i, r in enumerate(results) if r is not None]
+    row = {
+        "model": spec,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "p50_ms": np.percentile(latencies, 50) if latencies else float("nan"),
+        "p95_ms": np.percentile(latencies, 95) if latencies else float("nan"),
+        "p99_ms": np.percentile(latencies, 99) if latencies else float("nan"),
+        "mean_ms": np.mean(latencies) if latencies else float("nan"),
+        "overlap_captured": np.mean([overlap(results[i], records[i]["recommendations"]) for i in ok]) if ok else float("nan"),
+    }
+    if reference is not None:
+        both = [i for i in ok if reference[i] is not None]
+        row["overlap_first"] = np.mean([overlap(results[i], reference[i]) for i in both]) if both else float("nan")
+    return row
+
+
+def main(args):
+    records = read_captures(args.capture_dir, endpoint=args.endpoint, limit=args.limit)
+    if not records:
+        print(f"❌ {args.capture_dir} 沒有擷取紀錄")
+        return []
+    captured = [r["latency_ms"] for r in records]
+    versions = sorted({f"{r['model_name']}/{r['model_version']}" for r in records})
+    print(f"📼 {len(records)} 筆擷取紀錄（{', '.join(versions)}），"
+          f"線上延遲 p50 {np.percentile(captured, 50):.2f} ms、p95 {np.percentile(captured, 95):.2f} ms")
+
+    rows, per_request, reference = [], {}, None
+    for spec in args.models:
+        print(f"📦 Loading {model_uri(spec)} ...")
+        model = mlflow.pyfunc.load_model(model_uri(spec))
+        results, latencies = replay(model, records)
+        row = summarize(spec, records, results, latencies, reference if rows else None)
+        rows.append(row)
+        per_request[spec] = (results, latencies)
+        reference = reference or results
+        print(f"  ⏱️ p50 {row['p50_ms']:.2f} ms、p95 {row['p95_ms']:.2f} ms、p99 {row['p99_ms']:.2f} ms、"
+              f"overlap（線上）{row['overlap_captured']:.3f}"
+              + (f"、overlap（{args.models[0]}）{row['overlap_first']:.3f}" if "overlap_first" in row else ""))
+
+    print(pd.DataFrame(rows).round(3).to_string(index=False))
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["ts", "user_id", "model", "latency_ms", "captured_latency_ms", "overlap_captured"])
+            for spec, (results, latencies) in per_request.items():
+                for record, result, latency in zip(records, results, latencies):
+                    writer.writerow([
+                        record["ts"], record["user_id"], spec, round(latency, 3), record["latency_ms"],
+                        "" if result is None else round(overlap(result, record["recommendations"]), 3),
+                    ])
+        print(f"✅ 逐筆結果已寫入 {args.out}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以擷取的線上流量離線重播候選模型")
+    parser.add_argument("--capture-dir", default=DEFAULT_CAPTURE_DIR)
+    parser.add_argument("--models", nargs="+", required=True, help="例如 AnimeRecsysTFIDF/3 AnimeRecsysTFIDF/Staging")
+    parser.add_argument("--endpoint", default=None, help="只重播某個端點，例如 /recommend")
+    parser.add_argument("--limit", type=int, default=None, help="最多重播幾筆")
+    parser.add_argument("--out", default=None, help="逐筆結果 CSV")
+    args = parser.parse_args()
+
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI", "http://mlflow:5000"))
+    main(args)
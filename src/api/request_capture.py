@@ -0,0 +1,129 @@
+"""推薦請求的抽樣擷取：記錄實際的輸入、輸出、模型版本與延遲，供 replay.py 離線重播
+
+- 依 REQUEST_CAPTURE_RATE 抽樣（預設 0.1；0 = 關閉）
+- 請求執行緒只做 deque.append（CPython 中為 atomic，不需要 lock）；deque 設有 maxlen，
+  寫檔跟不上時丟棄最舊的紀錄，不會拖慢請求或吃光記憶體
+- 背景執行緒每 REQUEST_CAPTURE_FLUSH_SECONDS 秒把 buffer 清空，附加到每小時一個的 .jsonl.gz
+  （gzip 可多段串接，直接以附加模式寫入）
+
+檔案位置：<LOG_DIR>/captures/capture-YYYYMMDD-HH.jsonl.gz
+"""
+import os
+import json
+import gzip
+import zlib
+import random
+import threading
+from collections import deque
+from datetime import datetime
+
+SAMPLE_RATE = float(os.getenv("REQUEST_CAPTURE_RATE", "0.1"))
+CAPACITY = int(os.getenv("REQUEST_CAPTURE_BUFFER", "10000"))
+FLUSH_SECONDS = float(os.getenv("REQUEST_CAPTURE_FLUSH_SECONDS", "5"))
+
+
+class RequestCapture:
+    def __init__(self, out_dir, sample_rate=SAMPLE_RATE, capacity=CAPACITY, flush_interval=FLUSH_SECONDS):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.buffer = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self._flush_lock = threading.Lock()  # 只有寫檔端使用，請求端不會碰到
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, endpoint, model_name, model_version, user_id, anime_titles, recommendations, latency_ms):
+        """由呼叫端先以 sampled() 決定是否記錄"""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1  # 近似值：buffer 滿時 append 會擠掉最舊的一筆
+        self.buffer.append({
+            "ts": datetime.utcnow().isoformat(timespec="milliseconds"),
+            "endpoint": endpoint,
+            "model_name": model_name,
+            "model_version": model_version,
+            "user_id": user_id,
+            "anime_titles": list(anime_titles),
+            "recommendations": list(recommendations),
+            "latency_ms": round(latency_ms, 3),
+        })
+        self.captured += 1
+
+    def flush(self):
+        """把 buffer 中的紀錄附加到目前小時的檔案，回傳寫入筆數"""
+        with self._flush_lock:
+            records = []
+            while True:
+                try:
+                    records.append(self.buffer.popleft())
+                except IndexError:
+                    break
+            if not records:
+                return 0
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"capture-{datetime.utcnow():%Y%m%d-%H}.jsonl.gz")
+            payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                f.write(payload)
+            self.written += len(records)
+            return len(records)
+
+    def start(self):
+        if self.sample_rate <= 0:
+            return self
+        self._thread = threading.Thread(target=self._run, name="request-capture", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ 請求擷取寫檔失敗：{e}")
+        self.flush()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "buffered": len(self.buffer),
+            "captured": self.captured,
+            "written": self.written,
+            "dropped": self.dropped,
+            "out_dir": self.out_dir,
+        }
+
+
+def read_captures(capture_dir, endpoint=None, limit=None):
+    """依時間順序讀出擷取的紀錄（replay 使用）
+
+    目前小時的檔案可能正被 flush 附加新的 gzip 段落：讀到不完整的最後一段或半行時，
+    停止讀取該檔並保留已讀到的紀錄。
+    """
+    records = []
+    for name in sorted(os.listdir(capture_dir)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        try:
+            with gzip.open(os.path.join(capture_dir, name), "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # 寫到一半的最後一行
+                    record = json.loads(line)
+                    if endpoint is None or record["endpoint"] == endpoint:
+                        records.append(record)
+                        if limit is not None and len(records) >= limit:
+                            return records
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            print(f"⚠️ {name} 結尾不完整（可能正在寫入），略過其餘部分：{e}")
+    return records
@@ -0,0 +1,236 @@
+"""請求層級的取樣 profiler 與慢請求紀錄：不必在正式環境掛 debugger 也能看出尾端延遲花在哪裡
+
+- 每個請求都記錄各階段耗時（handler 內以 stage("get_model") / stage("predict") 包起來，成本只有 perf_counter）
+- 被選中 profile 的請求（PROFILE_SAMPLE_RATE 抽樣，或帶有 X-Profile-Token = PROFILE_TOKEN 的 header），
+  由單一背景執行緒每 PROFILE_INTERVAL_MS 毫秒讀一次該請求 worker 執行緒的 stack（sys._current_frames），
+  累計成 folded stacks（可直接餵給 flamegraph.pl / speedscope）；未被選中的請求完全不取樣
+- 總延遲超過 SLOW_REQUEST_MS（或以 header 指定 profile）的請求寫成一個 JSON 到 <LOG_DIR>/slow_requests，
+  只保留最新 SLOW_REQUEST_KEEP 個檔案
+
+TFIDFRecommender 內部的 transform / cosine / argsort 等步驟不另外計時，直接看 stack 取樣中對應的函式。
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "200"))
+PROFILE_HEADER = "x-profile-token"
+MAX_DEPTH = 64
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _folded_stack(frame):
+    """frame → "外層;...;內層"（每層為 函式 (檔名:行號)）"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """只對「登記中」的執行緒取樣；沒有登記時背景執行緒休眠，不佔 CPU"""
+
+    def __init__(self, interval_ms=INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._targets = {}  # thread ident → RequestTrace
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, ident, trace):
+        with self._lock:
+            self._targets[ident] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, ident):
+        with self._lock:
+            self._targets.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._targets
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                targets = list(self._targets.items())
+            for ident, trace in targets:
+                frame = frames.get(ident)
+                if frame is not None:
+                    trace.samples[_folded_stack(frame)] += 1
+            del frames
+
+
+class RequestTrace:
+    def __init__(self, method, path, query, profiled, forced, sampler):
+        self.id = uuid.uuid4().hex[:12]
+        self.ts = datetime.utcnow().isoformat(timespec="milliseconds")
+        self.method = method
+        self.path = path
+        self.query = query
+        self.profiled = profiled
+        self.forced = forced
+        self.stages = {}
+        self.samples = Counter()
+        self._sampler = sampler
+        self._threads = set()
+
+    @contextmanager
+    def stage(self, name):
+        ident = threading.get_ident()
+        if self.profiled and ident not in self._threads:
+            # sync handler 在 threadpool 執行：第一次進入階段時才登記實際執行的執行緒
+            self._threads.add(ident)
+            self._sampler.add(ident, self)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def finish(self):
+        for ident in self._threads:
+            self._sampler.remove(ident)
+        self._threads.clear()
+
+
+def stage(name):
+    """在 handler 中標記一個階段；不在請求中（或測試直接呼叫 handler）時不做任何事"""
+    trace = current_trace.get()
+    return nullcontext() if trace is None else trace.stage(name)
+
+
+class RequestProfiler:
+    def __init__(self, out_dir, sample_rate=SAMPLE_RATE, threshold_ms=SLOW_REQUEST_MS, keep=SLOW_REQUEST_KEEP,
+                 token=PROFILE_TOKEN, interval_ms=INTERVAL_MS):
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.keep = keep
+        self.token = token
+        self.interval_ms = interval_ms
+        self.sampler = StackSampler(interval_ms)
+        self.requests = 0
+        self.profiled = 0
+        self.slow = 0
+        self._stats_lock = threading.Lock()  # 計數在 event loop 與 threadpool 間共用
+        self._write_lock = threading.Lock()
+
+    def begin(self, method, path, query, headers):
+        """建立請求的 trace 並設為目前 context；回傳 (trace, contextvar token)"""
+        header = headers.get(PROFILE_HEADER, "")
+        forced = bool(self.token) and bool(header) and hmac.compare_digest(header, self.token)
+        profiled = forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        trace = RequestTrace(method, path, query, profiled, forced, self.sampler)
+        with self._stats_lock:
+            self.requests += 1
+            self.profiled += int(profiled)
+        return trace, current_trace.set(trace)
+
+    def end(self, trace, context_token, status_code, latency_ms):
+        """結束取樣；慢請求（或以 header 指定）寫入 slow_requests，回傳寫出的紀錄或 None"""
+        trace.finish()
+        current_trace.reset(context_token)
+        if latency_ms < self.threshold_ms and not trace.forced:
+            return None
+        staged = sum(trace.stages.values())
+        record = {
+            "id": trace.id,
+            "ts": trace.ts,
+            "method": trace.method,
+            "path": trace.path,
+            "query": trace.query,
+            "status_code": status_code,
+            "latency_ms": round(latency_ms, 3),
+            # other = 路由、驗證、回應序列化等 handler 階段以外的時間
+            "stages_ms": {**{k: round(v, 3) for k, v in trace.stages.items()}, "other": round(latency_ms - staged, 3)},
+            "profiled": trace.profiled,
+            "forced": trace.forced,
+            "sample_interval_ms": self.interval_ms,
+            "samples": sum(trace.samples.values()),
+            "stacks": dict(trace.samples.most_common()),
+        }
+        with self._stats_lock:
+            self.slow += 1
+        try:
+            self._write(record)
+        except OSError as e:
+            print(f"⚠️ 慢請求紀錄寫入失敗：{e}")
+        return record
+
+    def _write(self, record):
+        with self._write_lock:
+            os.makedirs(self.out_dir, exist_ok=True)
+            name = f"{record['ts'].replace(':', '').replace('-', '').replace('.', '')}-{record['id']}.json"
+            with open(os.path.join(self.out_dir, name), "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            files = sorted(f for f in os.listdir(self.out_dir) if f.endswith(".json"))
+            for old in files[:-self.keep] if self.keep > 0 else []:
+                os.remove(os.path.join(self.out_dir, old))
+
+    def _load(self, name):
+        try:
+            with open(os.path.join(self.out_dir, name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):  # 剛好被輪替刪除
+            return None
+
+    def recent(self, limit=20):
+        """最新的慢請求摘要：不含完整 stack，只列出取樣最多的最內層函式"""
+        if not os.path.isdir(self.out_dir):
+            return []
+        summaries = []
+        for name in sorted((f for f in os.listdir(self.out_dir) if f.endswith(".json")), reverse=True)[:limit]:
+            record = self._load(name)
+            if record is None:
+                continue
+            leaves = Counter()
+            for stack, count in record["stacks"].items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            summaries.append({
+                **{k: record[k] for k in ("id", "ts", "method", "path", "status_code", "latency_ms", "stages_ms", "samples")},
+                "hot_frames": leaves.most_common(3),
+            })
+        return summaries
+
+    def get(self, record_id):
+        if not os.path.isdir(self.out_dir):
+            return None
+        for name in os.listdir(self.out_dir):
+            if name.endswith(f"-{record_id}.json"):
+                return self._load(name)
+        return None
+
+    def stats(self):
+        with self._stats_lock:
+            counts = {"requests": self.requests, "profiled": self.profiled, "slow": self.slow}
+        return {
+            "sample_rate": self.sample_rate,
+            "threshold_ms": self.threshold_ms,
+            "token_enabled": bool(self.token),
+            **counts,
+            "out_dir": self.out_dir,
+        }